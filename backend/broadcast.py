@@ -0,0 +1,153 @@
+import asyncio, json, logging, os, uuid
+from collections import defaultdict
+from typing import Dict, List
+from fastapi import WebSocket
+
+# --- BACKPRESSURE-AWARE WEBSOCKET FAN-OUT + CROSS-WORKER PUB/SUB BUS ---
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))           # frames a client may lag behind before eviction
+WS_COALESCE_WINDOW = float(os.getenv("WS_COALESCE_WINDOW", "0.1"))  # burst events within this window share one frame
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))       # a single send slower than this evicts the client
+WS_BUS = os.getenv("WS_BUS", "memory")                           # "memory" (single worker) or "postgres" (LISTEN/NOTIFY)
+PG_CHANNEL = "live_attendance"
+PG_CACHE_CHANNEL = "cache_invalidation"  # response-cache invalidations, see cache.ResponseCache.start
+PG_PAYLOAD_LIMIT = 7000  # NOTIFY payloads must stay under 8000 bytes
+PG_RECONNECT_DELAY = float(os.getenv("WS_BUS_RECONNECT_DELAY", "1"))       # first retry; doubles up to the max
+PG_RECONNECT_MAX_DELAY = float(os.getenv("WS_BUS_RECONNECT_MAX_DELAY", "30"))
+log = logging.getLogger("knmiet.broadcast")
+
+class InMemoryBus:
+    # Single-process bus: every event published here is already delivered locally by the manager
+    async def start(self, handler): self.handler = handler
+    async def publish(self, items): pass
+    async def stop(self): pass
+
+class PostgresBus:
+    # LISTEN/NOTIFY over psycopg2: one listening connection watched by the event loop, one connection for NOTIFY.
+    # A dropped connection is logged and both are re-established with backoff; NOTIFY is not durable, so events
+    # published while a link is down are lost for the other workers (their own clients are unaffected).
+    def __init__(self, dsn: str, channel: str = PG_CHANNEL, reconnect_delay: float = PG_RECONNECT_DELAY, max_delay: float = PG_RECONNECT_MAX_DELAY):
+        self.dsn = dsn; self.channel = channel; self.origin = uuid.uuid4().hex[:12]
+        self.reconnect_delay = reconnect_delay; self.max_delay = max_delay
+        self.listen_conn = None; self.notify_conn = None; self.listen_fd = None; self.lock = asyncio.Lock(); self.reconnect_task = None; self.stopping = False
+    async def start(self, handler):
+        import psycopg2
+        self.handler = handler; self.errors = psycopg2.Error; self.loop = asyncio.get_running_loop(); self.stopping = False
+        self._connect(); self._watch()
+    def _connect(self):
+        import psycopg2
+        listen_conn = psycopg2.connect(self.dsn); listen_conn.autocommit = True
+        try:
+            notify_conn = psycopg2.connect(self.dsn); notify_conn.autocommit = True
+            with listen_conn.cursor() as cur: cur.execute(f"LISTEN {self.channel}")
+        except Exception: listen_conn.close(); raise
+        self.listen_conn, self.notify_conn = listen_conn, notify_conn
+    def _watch(self): self.listen_fd = self.listen_conn.fileno(); self.loop.add_reader(self.listen_fd, self._on_readable)
+    def _disconnect(self):
+        if self.listen_fd is not None: self.loop.remove_reader(self.listen_fd); self.listen_fd = None  # a broken connection can't report its fileno any more
+        for conn in (self.listen_conn, self.notify_conn):
+            if conn is not None:
+                try: conn.close()
+                except Exception: pass
+        self.listen_conn = self.notify_conn = None
+    def _connection_lost(self, where: str, error):
+        if self.stopping: return
+        log.warning("%s bus: %s connection lost (%s); reconnecting", self.channel, where, str(error).strip() or type(error).__name__)
+        self._disconnect()
+        if self.reconnect_task is None or self.reconnect_task.done(): self.reconnect_task = self.loop.create_task(self._reconnect())
+    async def _reconnect(self):
+        delay = self.reconnect_delay
+        while not self.stopping:
+            await asyncio.sleep(delay)
+            try: await asyncio.to_thread(self._connect)
+            except self.errors as e:
+                log.warning("%s bus: reconnect failed (%s); next try in %.0fs", self.channel, str(e).strip(), min(delay * 2, self.max_delay)); delay = min(delay * 2, self.max_delay); continue
+            if self.stopping: self._disconnect(); return
+            self._watch(); log.info("%s bus: reconnected", self.channel); return
+
+    def _on_readable(self):
+        try: self.listen_conn.poll()
+        except self.errors as e: return self._connection_lost("LISTEN", e)
+        while self.listen_conn.notifies:
+            note = self.listen_conn.notifies.pop(0)
+            try: data = json.loads(note.payload)
+            except ValueError: continue
+            if data.get("o") != self.origin: self.handler(data.get("e", []))  # our own events were delivered locally
+    def _notify(self, payloads):
+        with self.notify_conn.cursor() as cur:
+            for payload in payloads: cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+    async def publish(self, items):
+        payloads, chunk = [], []
+        for item in items:
+            if chunk and len(json.dumps({"o": self.origin, "e": chunk + [item]})) > PG_PAYLOAD_LIMIT:
+                payloads.append(json.dumps({"o": self.origin, "e": chunk})); chunk = []
+            chunk.append(item)
+        if chunk: payloads.append(json.dumps({"o": self.origin, "e": chunk}))
+        async with self.lock:
+            if self.notify_conn is None: log.warning("%s bus: down, %d events not sent to other workers", self.channel, len(items)); return
+            try: await asyncio.to_thread(self._notify, payloads)
+            except self.errors as e: log.warning("%s bus: %d events not sent to other workers", self.channel, len(items)); self._connection_lost("NOTIFY", e)
+    async def stop(self):
+        self.stopping = True
+        if self.reconnect_task is not None: self.reconnect_task.cancel()
+        self._disconnect()
+
+def make_bus(kind: str = WS_BUS, dsn: str = None, channel: str = PG_CHANNEL):
+    if kind == "postgres": return PostgresBus(dsn, channel)
+    return InMemoryBus()
+
+class Client:
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket; self.queue = asyncio.Queue(maxsize=queue_size); self.task = None
+
+class ConnectionManager:
+    def __init__(self, bus=None, queue_size: int = WS_QUEUE_SIZE, coalesce_window: float = WS_COALESCE_WINDOW, send_timeout: float = WS_SEND_TIMEOUT):
+        self.bus = bus or InMemoryBus(); self.queue_size = queue_size; self.coalesce_window = coalesce_window; self.send_timeout = send_timeout
+        self.active_connections: Dict[int, List[Client]] = {}
+        self.frames_sent = defaultdict(int); self.events_sent = defaultdict(int); self.evictions = 0  # read by /metrics
+    async def start(self): await self.bus.start(self.deliver)
+    async def stop(self):
+        await self.bus.stop()
+        for subject_id, clients in list(self.active_connections.items()):
+            for client in list(clients): self._evict(subject_id, client, evicted=False)
+    async def connect(self, websocket: WebSocket, subject_id: int):
+        await websocket.accept()
+        client = Client(websocket, self.queue_size)
+        client.task = asyncio.create_task(self._sender(subject_id, client))
+        self.active_connections.setdefault(subject_id, []).append(client)
+    def disconnect(self, websocket: WebSocket, subject_id: int):
+        for client in list(self.active_connections.get(subject_id, [])):
+            if client.websocket is websocket: self._evict(subject_id, client, close=False)
+
+    async def broadcast(self, subject_id: int, message: dict): await self.broadcast_many([(subject_id, message)])
+    async def broadcast_many(self, items):
+        # Never blocks on a socket: local clients get queued frames, other workers get the events through the bus
+        self.deliver(items)
+        try: await self.bus.publish(items)
+        except Exception: log.exception("live-attendance bus: publish failed")
+    def deliver(self, items):
+        for subject_id, message in items:
+            for client in list(self.active_connections.get(subject_id, [])):
+                try: client.queue.put_nowait(message)
+                except asyncio.QueueFull: self._evict(subject_id, client)  # too slow to keep up
+
+    async def _sender(self, subject_id: int, client: Client):
+        try:
+            while True:
+                frame = [await client.queue.get()]
+                if self.coalesce_window > 0: await asyncio.sleep(self.coalesce_window)
+                while not client.queue.empty(): frame.append(client.queue.get_nowait())
+                await asyncio.wait_for(client.websocket.send_json(frame), self.send_timeout)
+                self.frames_sent[subject_id] += 1; self.events_sent[subject_id] += len(frame)
+        except asyncio.CancelledError: raise
+        except Exception: self._evict(subject_id, client)
+    def _evict(self, subject_id: int, client: Client, close: bool = True, evicted: bool = None):
+        clients = self.active_connections.get(subject_id, [])
+        if client in clients:
+            clients.remove(client)
+            if close if evicted is None else evicted: self.evictions += 1  # shutdown and client-side disconnects aren't evictions
+        if not clients: self.active_connections.pop(subject_id, None)
+        if client.task is not None and client.task is not asyncio.current_task(): client.task.cancel()
+        if close: asyncio.ensure_future(self._close(client.websocket))
+    async def _close(self, websocket: WebSocket):
+        try: await websocket.close()
+        except Exception: pass
@@ -0,0 +1,115 @@
+import asyncio, hashlib, json, logging, os, threading, time
+from collections import OrderedDict
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+# --- READ-THROUGH RESPONSE CACHE: BOUNDED LRU + TTL, EXPLICIT INVALIDATION, ETAG/304 ---
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))  # also bounds staleness on other workers while the invalidation bus is down
+log = logging.getLogger("knmiet.cache")
+
+def render(payload) -> bytes:
+    # Same encoding FastAPI's JSONResponse would produce, done once per cache fill
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+class ResponseCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL):
+        self.max_entries = max_entries; self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (body, etag, expires_at)
+        self.lock = threading.Lock()
+        self.clock = 0; self.floor = 0; self.stamps = {}  # invalidated prefix -> clock at its last invalidation; floor stands in for pruned ones
+        self.bus = None; self.loop = None; self.outbox = []; self.flush_task = None
+        self.hits = self.misses = self.not_modified = self.invalidations = self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None: del self.entries[key]
+                self.misses += 1; return None
+            self.entries.move_to_end(key); self.hits += 1
+            return entry
+
+    def _version(self, key):
+        # Latest invalidation that covers key: ("erp", roll) is covered by ("erp", roll), ("erp") and a full clear
+        return max(self.stamps.get(key[:i], self.floor) for i in range(len(key) + 1))
+
+    def generation(self, key):
+        with self.lock: return self._version(key)
+
+    def put(self, key, body: bytes, generation: int):
+        entry = (body, '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"', time.monotonic() + self.ttl)
+        with self.lock:
+            # An invalidation of this key that landed while the payload was being built makes it unsafe to keep;
+            # invalidations of other students or endpoints don't
+            if self._version(key) != generation: return entry
+            self.entries[key] = entry; self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries: self.entries.popitem(last=False); self.evictions += 1
+        return entry
+
+    def invalidate(self, *prefix):
+        # invalidate("erp", roll) drops one student's ERP payload; invalidate("erp") drops them all.
+        # Other workers replay it through the bus.
+        self._drop(prefix)
+        if self.bus is not None: self._publish(prefix)
+
+    def _drop(self, prefix):
+        with self.lock:
+            self.clock += 1; self.stamps[prefix] = self.clock; self.invalidations += 1
+            if len(self.stamps) > self.max_entries: self.stamps.clear(); self.floor = self.clock  # conservative: every open fill is dropped
+            if not prefix: self.entries.clear(); return
+            for key in [k for k in self.entries if k[:len(prefix)] == prefix]: del self.entries[key]
+
+    # --- CROSS-WORKER INVALIDATION: prefixes are batched onto the event loop and published on the bus ---
+    async def start(self, bus):
+        self.loop = asyncio.get_running_loop(); await bus.start(self._remote); self.bus = bus
+
+    async def stop(self):
+        bus, self.bus = self.bus, None
+        if bus is not None: await bus.stop()
+
+    def _remote(self, prefixes):
+        for prefix in prefixes: self._drop(tuple(prefix))
+
+    def _publish(self, prefix):
+        # Called from request threads and the loop alike; one flush per loop turn carries every pending prefix
+        with self.lock:
+            self.outbox.append(list(prefix))
+            if len(self.outbox) > 1: return
+        try: self.loop.call_soon_threadsafe(self._schedule_flush)
+        except RuntimeError: pass  # loop already closed: shutting down
+
+    def _schedule_flush(self): self.flush_task = self.loop.create_task(self._flush())
+
+    async def _flush(self):
+        with self.lock: prefixes, self.outbox = self.outbox, []
+        if self.bus is None: return
+        try: await self.bus.publish(prefixes)
+        except Exception: log.exception("cache invalidation bus: publish failed")
+
+    def respond(self, request: Request, entry):
+        body, etag, _ = entry
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}  # browsers must revalidate, which is what makes 304s happen
+        sent = request.headers.get("if-none-match", "")
+        if etag in [t.strip().removeprefix("W/") for t in sent.split(",")]:
+            with self.lock: self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def cached(self, request: Request, key, build):
+        entry = self.get(key)
+        if entry is None: generation = self.generation(key); entry = self.put(key, render(build()), generation)
+        return self.respond(request, entry)
+
+    async def cached_async(self, request: Request, key, build):
+        entry = self.get(key)
+        if entry is None: generation = self.generation(key); entry = self.put(key, render(await build()), generation)
+        return self.respond(request, entry)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": round(self.hits / lookups, 4) if lookups else 0, "not_modified": self.not_modified, "invalidations": self.invalidations, "evictions": self.evictions}
+
+response_cache = ResponseCache()
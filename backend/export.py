@@ -0,0 +1,47 @@
+import csv, io, os
+from datetime import date, datetime, time, timedelta, timezone
+from sqlalchemy import and_, func, or_, select
+
+from . import models, database
+from .queries import _attendance_counts, _marks
+
+# --- STREAMING BRANCH/SEMESTER EXPORT: SERVER-SIDE CURSOR IN, CHUNKED CSV OUT ---
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "2000"))  # rows pulled from the cursor per round trip
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))  # CSV rows per chunk written to the socket
+HEADER = ["Roll Number", "Student Name", "Branch", "Year", "Section", "Subject Code", "Subject Name", "Attended", "Total Lectures", "Attendance %", "Sessional 1", "Sessional 2", "PUT"]
+
+def export_query(branch: str = None, year: int = None, section: str = None, start: date = None, end: date = None):
+    # One row per (student, subject of the student's class), ordered so the sheet reads student by student
+    S, J, A, M = models.Student, models.Subject, models.Attendance, models.ExamMarks
+    sf = [S.status == "Approved"]
+    if branch: sf.append(S.branch == branch)
+    if year: sf.append(S.year == year)
+    if section: sf.append(S.section == section)
+    rolls = select(S.roll_no).where(*sf)
+    att_f = [A.student_roll.in_(rolls)]
+    if start is not None: att_f.append(A.timestamp >= datetime.combine(start, time.min, timezone.utc))
+    if end is not None: att_f.append(A.timestamp < datetime.combine(end + timedelta(days=1), time.min, timezone.utc))
+    att, m = _attendance_counts(*att_f), _marks(M.student_roll.in_(rolls))
+    held, ranged = func.coalesce(J.total_lectures_held, 0), start is not None or end is not None
+    if ranged:
+        # Sessions aren't stored per date, so lectures held in the range are taken from the best-attending student of each subject
+        best = select(att.c.subject_id, func.max(att.c.attended).label("held")).group_by(att.c.subject_id).subquery(); held = func.coalesce(best.c.held, 0)
+    q = (select(S.roll_no, S.name, S.branch, S.year, S.section, J.code, J.name, func.coalesce(att.c.attended, 0), held, m.c.s1, m.c.s2, m.c.put).select_from(S)
+         .join(J, and_(or_(J.branch == S.branch, J.branch == "ALL"), J.year == S.year, J.section == S.section))
+         .outerjoin(att, and_(att.c.student_roll == S.roll_no, att.c.subject_id == J.id)).outerjoin(m, and_(m.c.student_roll == S.roll_no, m.c.subject_id == J.id)))
+    if ranged: q = q.outerjoin(best, best.c.subject_id == J.id)
+    return q.where(*sf).order_by(S.branch, S.year, S.section, S.roll_no, J.id)
+
+def stream_csv(query, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    # Runs in Starlette's threadpool; owns its session because it outlives the request handler
+    buf = io.StringIO(); writer = csv.writer(buf); writer.writerow(HEADER); pending = 0
+    with database.SessionLocal() as db:
+        for roll, name, branch, year, section, code, subject, attended, held, s1, s2, put in db.execute(query.execution_options(yield_per=EXPORT_FETCH_SIZE)):
+            writer.writerow([roll, name, branch, year, section, code, subject, attended, held, round(attended / held * 100, 1) if held else 0, s1 or 0, s2 or 0, put or 0]); pending += 1
+            if pending >= chunk_rows: yield buf.getvalue(); buf.seek(0); buf.truncate(); pending = 0
+    yield buf.getvalue()
+
+def export_filename(branch, year, section, start, end):
+    parts = ["KNMIET", branch or "ALL"] + ([f"Year{year}"] if year else []) + ([f"Sec{section}"] if section else [])
+    if start or end: parts.append(f"{start or 'start'}_to_{end or 'today'}")
+    return "_".join(parts) + ".csv"
@@ -0,0 +1,82 @@
+import asyncio, logging, os
+from collections import Counter
+from sqlalchemy import insert, update, case
+
+from . import models, database, rollup
+
+# --- GROUP-COMMIT SCAN INGESTION: ONE INSERT + ONE COUNTER UPDATE + ONE ROLLUP UPSERT + ONE COMMIT PER MICRO-BATCH ---
+SCAN_BATCHING = os.getenv("SCAN_BATCHING", "1") != "0"
+SCAN_BATCH_SIZE = int(os.getenv("SCAN_BATCH_SIZE", "200"))
+SCAN_FLUSH_INTERVAL = float(os.getenv("SCAN_FLUSH_INTERVAL", "0.05"))
+SCAN_ACK_TIMEOUT = float(os.getenv("SCAN_ACK_TIMEOUT", "2.0"))
+SCAN_RETRY_DELAY = float(os.getenv("SCAN_RETRY_DELAY", "0.5"))  # pause before a failed batch is retried row by row
+log = logging.getLogger("knmiet.ingest")
+
+def write_scan_batch(keys):
+    # keys: list of (roll_no, subject_id), already de-duplicated by the batcher
+    db = database.SessionLocal()
+    try:
+        db.execute(insert(models.Attendance).values([{"student_roll": r, "subject_id": s} for r, s in keys]))
+        counts = Counter(r for r, _ in keys)
+        db.execute(update(models.Student).where(models.Student.roll_no.in_(list(counts))).values(total_lectures=models.Student.total_lectures + case(counts, value=models.Student.roll_no, else_=0)).execution_options(synchronize_session=False))
+        rollup.record_scans(db, keys)
+        db.commit()
+    finally:
+        db.close()
+
+class ScanBatcher:
+    def __init__(self, on_commit, batch_size: int = SCAN_BATCH_SIZE, flush_interval: float = SCAN_FLUSH_INTERVAL, writer=write_scan_batch):
+        self.on_commit = on_commit; self.batch_size = batch_size; self.flush_interval = flush_interval; self.writer = writer
+        self.queue = None; self.task = None
+        self.pending = set()  # (roll_no, subject_id) queued but not yet durable -> in-flight duplicate guard
+    def start(self):
+        if self.task is None: self.queue = asyncio.Queue(); self.task = asyncio.create_task(self._run())
+    async def stop(self):
+        if self.task is None: return
+        self.queue.put_nowait(None); await self.task; self.task = None
+    def is_pending(self, roll_no: str, subject_id: int): return (roll_no, subject_id) in self.pending
+    def submit(self, roll_no: str, subject_id: int, event: dict):
+        # Returns a future resolved once the scan is committed, or None if the same scan is already in flight
+        key = (roll_no, subject_id)
+        if key in self.pending: return None
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # callers may have stopped waiting (202 Queued); failures are logged in _flush
+        self.pending.add(key); self.queue.put_nowait((key, event, fut))
+        return fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop(); stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None: break
+            batch = [item]; deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0: break
+                try: item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError: break
+                if item is None: stopping = True; break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        keys = [key for key, _, _ in batch]; committed = batch
+        try:
+            try: await asyncio.to_thread(self.writer, keys)
+            except Exception:
+                # One bad row or a transient DB error fails the whole batch: back off, then write row by row so the rest still land
+                log.exception("scan batch of %d failed, retrying row by row", len(batch))
+                await asyncio.sleep(SCAN_RETRY_DELAY); committed = []
+                for item in batch:
+                    key, _, fut = item
+                    try: await asyncio.to_thread(self.writer, [key]); committed.append(item)
+                    except Exception as e:
+                        log.error("scan lost: roll_no=%s subject_id=%s (%r)", key[0], key[1], e)
+                        if not fut.done(): fut.set_exception(e)
+        finally: self.pending.difference_update(keys)
+        for _, _, fut in committed:
+            if not fut.done(): fut.set_result(True)
+        if not committed: return
+        try: await self.on_commit([event for _, event, _ in committed])
+        except Exception: log.exception("post-commit hook failed for %d scans", len(committed))
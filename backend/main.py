@@ -1,21 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Header, WebSocket, WebSocketDisconnect
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_, or_, Column, Integer, String, Boolean, Float, DateTime
-from datetime import datetime, timedelta
-from typing import List, Dict
-import random, string, csv, io
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, and_, Column, Integer, String, Boolean, Float, DateTime
+from datetime import date, datetime, timedelta
+from contextlib import asynccontextmanager
+import asyncio
 
-from . import models, database
+from . import models, database, ingest, session_engine, queries, roster_import, broadcast, metrics, rollup, export, marks
+from .cache import response_cache
 from .database import engine
 
-models.Base.metadata.create_all(bind=engine)
+with database.migration_lock(engine):
+    models.Base.metadata.create_all(bind=engine)
+    database.add_missing_columns(models.Base.metadata, engine)
+    marks.dedupe(engine)  # must precede the unique marks index below
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes: database.create_index(index, engine)  # create_all skips indexes on pre-existing tables
+    rollup.backfill(engine)  # no-op once attendance_daily is populated
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await manager.start(); await response_cache.start(broadcast.make_bus(dsn=database.SQLALCHEMY_DATABASE_URL, channel=broadcast.PG_CACHE_CHANNEL)); scan_batcher.start()
+    yield
+    await scan_batcher.stop(); await response_cache.stop(); await manager.stop(); await database.async_engine.dispose()  # asyncpg connections are bound to this event loop
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/frontend", StaticFiles(directory="frontend"), name="frontend")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(metrics.MetricsMiddleware); metrics.instrument_engines()
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError):
+    # FastAPI's default 422 body minus the echoed input: a rejected NaN/Infinity cell cannot be encoded as JSON
+    return JSONResponse(status_code=422, content={"detail": jsonable_encoder([{k: v for k, v in e.items() if k != "input"} for e in exc.errors()])})
 
 ADMIN_KEYS = {"KNM@2026!Admin": "ALL", "CSE@2026!HOD": "CSE", "IT@2026!HOD": "IT", "AI@2026!HOD": "AI", "ECE@2026!HOD": "ECE", "EE@2026!HOD": "EE", "CHE@2026!HOD": "CHE"}
 def get_admin_branch(key: str):
@@ -23,223 +45,235 @@ def get_admin_branch(key: str):
     if not branch: raise HTTPException(status_code=401, detail="Unauthorized Admin Key")
     return branch
 
-active_sessions = {}
-
 # --- FINAL FIX: WEBSOCKET MANAGER FOR ZERO SERVER OVERLOAD ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {}
-    async def connect(self, websocket: WebSocket, subject_id: int):
-        await websocket.accept()
-        if subject_id not in self.active_connections: self.active_connections[subject_id] = []
-        self.active_connections[subject_id].append(websocket)
-    def disconnect(self, websocket: WebSocket, subject_id: int):
-        if subject_id in self.active_connections and websocket in self.active_connections[subject_id]:
-            self.active_connections[subject_id].remove(websocket)
-    async def broadcast(self, subject_id: int, message: dict):
-        if subject_id in self.active_connections:
-            for connection in self.active_connections[subject_id]:
-                await connection.send_json(message)
-
-manager = ConnectionManager()
+manager = broadcast.ConnectionManager(bus=broadcast.make_bus(dsn=database.SQLALCHEMY_DATABASE_URL))
+def invalidate_student(roll_no: str):
+    for endpoint in ("profile", "erp", "history"): response_cache.invalidate(endpoint, roll_no)
+
+async def on_scans_committed(events):
+    for e in events: invalidate_student(e["payload"]["roll_no"])
+    await manager.broadcast_many([(e["subject_id"], e["payload"]) for e in events])
+
+scan_batcher = ingest.ScanBatcher(on_commit=on_scans_committed)
 
 @app.websocket("/ws/live-attendance/{subject_id}")
 async def websocket_endpoint(websocket: WebSocket, subject_id: int):
     await manager.connect(websocket, subject_id)
     try:
         while True: await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, subject_id)
+    except (WebSocketDisconnect, RuntimeError): pass
+    finally: manager.disconnect(websocket, subject_id)
 
 @app.get("/")
 async def root(): return RedirectResponse(url="/frontend/index.html")
 @app.get("/admin-verify")
 async def verify_admin(x_admin_key: str = Header(...)): return {"branch": get_admin_branch(x_admin_key)}
+@app.get("/admin-export")
+def admin_export(x_admin_key: str = Header(...), branch: str = None, year: int = None, section: str = None, start: date = None, end: date = None):
+    # Whole branch/semester attendance + marks sheet, streamed as CSV straight off a server-side cursor
+    admin_branch = get_admin_branch(x_admin_key)
+    if admin_branch != "ALL":
+        if branch and branch != admin_branch: raise HTTPException(status_code=403, detail="Outside your branch")
+        branch = admin_branch
+    filename = export.export_filename(branch, year, section, start, end)
+    return StreamingResponse(export.stream_csv(export.export_query(branch, year, section, start, end)), media_type="text/csv", headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 @app.get("/reset-database-danger")
-async def reset_db(x_admin_key: str = Header(...)):
+def reset_db(x_admin_key: str = Header(...)):
     if get_admin_branch(x_admin_key) != "ALL": raise HTTPException(status_code=403)
-    models.Base.metadata.drop_all(bind=engine); models.Base.metadata.create_all(bind=engine)
+    models.Base.metadata.drop_all(bind=engine); models.Base.metadata.create_all(bind=engine); response_cache.invalidate()
     return {"message": "Database wiped!"}
 
 @app.post("/upload-roster")
 async def upload_roster(file: UploadFile = File(...), x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     admin_branch = get_admin_branch(x_admin_key)
-    content = await file.read(); decoded = content.decode('utf-8'); reader = csv.DictReader(io.StringIO(decoded)); count = 0
-    for row in reader:
-        r_key = next((k for k in row.keys() if k and 'roll' in k.lower()), None); n_key = next((k for k in row.keys() if k and 'name' in k.lower()), None)
-        b_key = next((k for k in row.keys() if k and 'branch' in k.lower()), None); y_key = next((k for k in row.keys() if k and 'year' in k.lower()), None); s_key = next((k for k in row.keys() if k and 'sec' in k.lower()), None)
-        if not r_key or not row[r_key]: continue
-        row_branch = str(row[b_key]).strip().upper() if b_key else "CSE"
-        if admin_branch != "ALL" and row_branch != admin_branch: continue
-        roll_no = str(row[r_key]).strip()
-        if not db.query(models.Student).filter(models.Student.roll_no == roll_no).first():
-            sec_val = str(row[s_key]).strip().upper().replace("SEC ", "").replace("SECTION ", "") if s_key else "A"
-            db.add(models.Student(erp_id="PENDING", roll_no=roll_no, name=str(row[n_key]).strip() if n_key else "Unknown", branch=row_branch, year=int(row[y_key]) if y_key else 1, section=sec_val, registered_device="UNREGISTERED", status="Approved", total_lectures=0))
-            count += 1
-    db.commit(); return {"message": f"Successfully pre-approved {count} students!"}
+    try: return await asyncio.to_thread(roster_import.import_roster, file.file, admin_branch, db)
+    except UnicodeDecodeError: raise HTTPException(status_code=400, detail="Roster must be a UTF-8 CSV file")
+    finally: response_cache.invalidate("profile")  # cached "exists": False answers for freshly imported rolls
 
 @app.post("/register-student")
-async def register(erp_id: str, roll_no: str, name: str, branch: str, year: int, section: str, device_id: str, db: Session = Depends(database.get_db)):
+def register(erp_id: str, roll_no: str, name: str, branch: str, year: int, section: str, device_id: str, db: Session = Depends(database.get_db)):
     if len(roll_no) != 13: raise HTTPException(status_code=400, detail="13 digits required")
     existing = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
     if existing:
-        if existing.status == "Rejected": existing.name = name; existing.branch = branch; existing.year = year; existing.section = section; existing.registered_device = device_id; existing.status = "Pending"; db.commit(); return {"status": "success", "message": "Re-application submitted."}
-        if existing.registered_device == "UNREGISTERED" or existing.registered_device == "PENDING_RESET": existing.erp_id = erp_id; existing.name = name; existing.branch = branch; existing.year = year; existing.section = section; existing.registered_device = device_id; existing.status = "Approved"; db.commit(); return {"status": "success", "message": "Device Linked!"}
+        if existing.status == "Rejected": existing.name = name; existing.branch = branch; existing.year = year; existing.section = section; existing.registered_device = device_id; existing.status = "Pending"; db.commit(); invalidate_student(roll_no); return {"status": "success", "message": "Re-application submitted."}
+        if existing.registered_device == "UNREGISTERED" or existing.registered_device == "PENDING_RESET": existing.erp_id = erp_id; existing.name = name; existing.branch = branch; existing.year = year; existing.section = section; existing.registered_device = device_id; existing.status = "Approved"; db.commit(); invalidate_student(roll_no); return {"status": "success", "message": "Device Linked!"}
         if existing.name.strip().lower() == name.strip().lower(): return {"status": "success", "message": "Welcome back!"}
         raise HTTPException(status_code=403, detail="Roll Number already registered to another device!")
-    db.add(models.Student(erp_id=erp_id, name=name, roll_no=roll_no, branch=branch, year=year, section=section, registered_device=device_id, status="Pending", total_lectures=0)); db.commit()
+    db.add(models.Student(erp_id=erp_id, name=name, roll_no=roll_no, branch=branch, year=year, section=section, registered_device=device_id, status="Pending", total_lectures=0)); db.commit(); invalidate_student(roll_no)
     return {"status": "success", "message": "Registered! Awaiting approval."}
 
 @app.get("/student-profile")
-async def get_profile(roll_no: str, db: Session = Depends(database.get_db)):
-    s = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
-    if not s: return {"exists": False}
-    leaves = db.query(models.LeaveRequest).filter_by(student_roll=roll_no, status="Approved").count()
-    return {"exists": True, "status": s.status, "name": s.name, "branch": s.branch, "year": s.year, "section": s.section, "total_lectures": s.total_lectures, "official_leaves": leaves}
+async def get_profile(roll_no: str, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    async def build():
+        s = await db.scalar(select(models.Student).where(models.Student.roll_no == roll_no))
+        if not s: return {"exists": False}
+        leaves = await db.scalar(select(func.count()).select_from(models.LeaveRequest).where(models.LeaveRequest.student_roll == roll_no, models.LeaveRequest.status == "Approved"))
+        return {"exists": True, "status": s.status, "name": s.name, "branch": s.branch, "year": s.year, "section": s.section, "total_lectures": s.total_lectures, "official_leaves": leaves}
+    return await response_cache.cached_async(request, ("profile", roll_no), build)
 
 @app.get("/student-erp-data")
-async def student_erp(roll_no: str, db: Session = Depends(database.get_db)):
-    s = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
-    subs = db.query(models.Subject).filter(or_(models.Subject.branch == s.branch, models.Subject.branch == "ALL"), models.Subject.year == s.year, models.Subject.section == s.section).all()
-    data = []
-    for sub in subs:
-        att = db.query(models.Attendance).filter(models.Attendance.student_roll == roll_no, models.Attendance.subject_id == sub.id).count()
-        m = db.query(models.ExamMarks).filter_by(student_roll=roll_no, subject_id=sub.id).first()
-        data.append({"subject_name": sub.name, "code": sub.code, "attended": att, "total_held": sub.total_lectures_held or 0, "s1": m.sessional_1 if m else 0, "s2": m.sessional_2 if m else 0, "put": m.put_marks if m else 0})
-    return {"subjects": data, "overall_attended": s.total_lectures}
+async def student_erp(roll_no: str, request: Request, db: AsyncSession = Depends(database.get_async_db)):
+    async def build():
+        s = await db.scalar(select(models.Student).where(models.Student.roll_no == roll_no))
+        return {"subjects": await queries.student_subjects(db, s), "overall_attended": s.total_lectures}
+    return await response_cache.cached_async(request, ("erp", roll_no), build)
 
 @app.get("/student-attendance-history")
-async def student_history(roll_no: str, db: Session = Depends(database.get_db)):
-    student = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
-    subjects = db.query(models.Subject).filter(or_(models.Subject.branch == student.branch, models.Subject.branch == "ALL"), models.Subject.year == student.year, models.Subject.section == student.section).all()
-    attendance_records = db.query(models.Attendance).filter(models.Attendance.student_roll == roll_no).order_by(models.Attendance.timestamp.desc()).all()
-    history_by_date = {}
-    for record in attendance_records:
-        date_str = record.timestamp.strftime("%d-%m-%y")
-        if date_str not in history_by_date: history_by_date[date_str] = []
-        history_by_date[date_str].append(record.subject_id)
-    approved_leaves = [l.date_req for l in db.query(models.LeaveRequest).filter_by(student_roll=roll_no, status="Approved").all()]
-    for d in approved_leaves:
-        if d not in history_by_date: history_by_date[d] = [] 
-    return {"subjects": [{"id": s.id, "code": s.code} for s in subjects], "history": history_by_date, "approved_leaves": approved_leaves}
+def student_history(roll_no: str, request: Request, start: date = None, end: date = None, before: date = None, limit: int = queries.HISTORY_PAGE_SIZE, db: Session = Depends(database.get_db)):
+    def build():
+        page = queries.attendance_history(db, roll_no, start, end, before, limit)
+        if page is None: raise HTTPException(status_code=404, detail="Student not found")
+        return page
+    return response_cache.cached(request, ("history", roll_no, start, end, before, limit), build)
 
 @app.post("/mark-attendance")
-async def mark_attendance(roll_no: str, qr_content: str, subject_id: int, device_id: str, db: Session = Depends(database.get_db)):
-    if subject_id not in active_sessions or active_sessions[subject_id] != qr_content: raise HTTPException(status_code=400, detail="QR Expired!")
-    student = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
+async def mark_attendance(roll_no: str, qr_content: str, subject_id: int, device_id: str, db: AsyncSession = Depends(database.get_async_db)):
+    if not session_engine.verify_qr(subject_id, qr_content) or not await session_engine.session_open_async(db, subject_id, qr_content.partition(".")[0]): raise HTTPException(status_code=400, detail="QR Expired!")
+    student = await db.scalar(select(models.Student).where(models.Student.roll_no == roll_no))
     if not student or student.status != "Approved": raise HTTPException(status_code=403, detail="Director Approval Required")
     if student.registered_device != device_id: raise HTTPException(status_code=403, detail="Device ID Security Mismatch")
-    subject = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
+    subject = await db.get(models.Subject, subject_id)
     if (student.branch != subject.branch and subject.branch != "ALL") or student.year != subject.year or student.section != subject.section: raise HTTPException(status_code=403, detail="Access Denied! Wrong Class.")
     time_limit = datetime.utcnow() - timedelta(minutes=40)
-    if db.query(models.Attendance).filter(models.Attendance.student_roll == roll_no, models.Attendance.subject_id == subject_id, models.Attendance.timestamp >= time_limit).first(): raise HTTPException(status_code=400, detail="Duplicate Scan!")
-    
+    if scan_batcher.is_pending(roll_no, subject_id) or await db.scalar(select(models.Attendance.id).where(models.Attendance.student_roll == roll_no, models.Attendance.subject_id == subject_id, models.Attendance.timestamp >= time_limit).limit(1)): raise HTTPException(status_code=400, detail="Duplicate Scan!")
+    payload = {"name": student.name, "roll_no": student.roll_no, "branch": student.branch, "section": student.section}
+
+    if ingest.SCAN_BATCHING:
+        # Group commit: the writer flushes a micro-batch and broadcasts once it is durable
+        await db.close()
+        fut = scan_batcher.submit(roll_no, subject_id, {"subject_id": subject_id, "payload": payload})
+        if fut is None: raise HTTPException(status_code=400, detail="Duplicate Scan!")
+        try: await asyncio.wait_for(asyncio.shield(fut), ingest.SCAN_ACK_TIMEOUT)
+        except asyncio.TimeoutError: return JSONResponse(status_code=202, content={"status": "Queued"})  # accepted, not yet durable
+        except Exception: raise HTTPException(status_code=503, detail="Attendance could not be saved, scan again.")
+        return {"status": "Success"}
+
     student.total_lectures += 1
-    db.add(models.Attendance(student_roll=roll_no, subject_id=subject_id)); db.commit()
+    db.add(models.Attendance(student_roll=roll_no, subject_id=subject_id)); await db.run_sync(rollup.record_scans, [(roll_no, subject_id)])
+    await db.commit(); invalidate_student(roll_no)
     
     # BROADCAST TO TEACHER VIA WEBSOCKET
-    await manager.broadcast(subject_id, {"name": student.name, "roll_no": student.roll_no, "branch": student.branch, "section": student.section})
+    await manager.broadcast(subject_id, payload)
     return {"status": "Success"}
 
 @app.post("/request-leave")
-async def request_leave(roll_no: str, date_req: str, reason: str, db: Session = Depends(database.get_db)):
+def request_leave(roll_no: str, date_req: str, reason: str, db: Session = Depends(database.get_db)):
     db.add(models.LeaveRequest(student_roll=roll_no, date_req=date_req, reason=reason)); db.commit(); return {"message": "Leave requested"}
 @app.get("/student-leaves")
-async def get_student_leaves(roll_no: str, db: Session = Depends(database.get_db)): return db.query(models.LeaveRequest).filter_by(student_roll=roll_no).order_by(models.LeaveRequest.id.desc()).all()
+def get_student_leaves(roll_no: str, db: Session = Depends(database.get_db)): return db.query(models.LeaveRequest).filter_by(student_roll=roll_no).order_by(models.LeaveRequest.id.desc()).all()
 @app.get("/pending-leaves")
-async def get_pending_leaves(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def get_pending_leaves(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     admin_branch = get_admin_branch(x_admin_key)
-    leaves = db.query(models.LeaveRequest).filter_by(status="Pending").all(); res = []
-    for l in leaves:
-        s = db.query(models.Student).filter_by(roll_no=l.student_roll).first()
-        if s and (admin_branch == "ALL" or s.branch == admin_branch): res.append({"id": l.id, "name": s.name, "roll_no": s.roll_no, "date_req": l.date_req, "reason": l.reason})
-    return res
+    return queries.pending_leaves(db, admin_branch)
 @app.post("/update-leave-status")
-async def update_leave_status(leave_id: int, status: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def update_leave_status(leave_id: int, status: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     l = db.query(models.LeaveRequest).filter_by(id=leave_id).first()
-    if l: l.status = status; db.commit()
+    if l: l.status = status; db.commit(); invalidate_student(l.student_roll)
     return {"message": "Success"}
 
 @app.get("/pending-students")
-async def get_pending(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def get_pending(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     admin_branch = get_admin_branch(x_admin_key)
     query = db.query(models.Student).filter(models.Student.status == "Pending")
     if admin_branch != "ALL": query = query.filter(models.Student.branch == admin_branch)
     return query.all()
 @app.post("/update-student-status")
-async def update_status(roll_no: str, status: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def update_status(roll_no: str, status: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     student = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
-    if student: student.status = status; db.commit(); return {"message": f"Student {status}"}
+    if student: student.status = status; db.commit(); invalidate_student(roll_no); return {"message": f"Student {status}"}
 @app.post("/reset-student-device")
-async def reset_device(roll_no: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def reset_device(roll_no: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     student = db.query(models.Student).filter(models.Student.roll_no == roll_no).first()
     if student: student.registered_device = "PENDING_RESET"; db.commit(); return {"message": "Device reset successful"}
 @app.post("/assign-subject")
-async def assign_subject(name: str, code: str, branch: str, year: int, section: str, teacher_id: int, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def assign_subject(name: str, code: str, branch: str, year: int, section: str, teacher_id: int, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     db.add(models.Subject(name=name, code=code, branch=branch, year=year, section=section, teacher_id=teacher_id, total_lectures_held=0)); db.commit()
+    response_cache.invalidate("teacher-subjects", teacher_id); response_cache.invalidate("erp"); response_cache.invalidate("history")  # new column in every section student's view
     return {"message": "Subject Linked"}
 @app.post("/add-teacher")
-async def add_teacher(name: str, email: str, pin: str, role: str, department: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
-    db.add(models.Teacher(name=name, email=email, pin=pin, role=role, department=department)); db.commit()
+def add_teacher(name: str, email: str, pin: str, role: str, department: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+    db.add(models.Teacher(name=name, email=email, pin=pin, role=role, department=department)); db.commit(); response_cache.invalidate("teachers")
     return {"message": "Teacher Added"}
 @app.get("/get-teachers")
-async def get_t(db: Session = Depends(database.get_db)): return db.query(models.Teacher).all()
+def get_t(request: Request, db: Session = Depends(database.get_db)):
+    # Public login list: never the PIN, which is what gates the teacher's QR session routes
+    return response_cache.cached(request, ("teachers",), lambda: [{"id": i, "name": n, "role": r} for i, n, r in db.query(models.Teacher.id, models.Teacher.name, models.Teacher.role).order_by(models.Teacher.id)])
 @app.get("/all-students-analytics")
-async def all_analytics(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def all_analytics(x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     admin_branch = get_admin_branch(x_admin_key)
     query = db.query(models.Student)
     if admin_branch != "ALL": query = query.filter(models.Student.branch == admin_branch)
     return query.all()
+@app.get("/branch-analytics")
+def branch_analytics(since: datetime = None, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+    # Columnar student x subject matrix for the HOD dashboard; pass back "as_of" as ?since= for deltas
+    admin_branch = get_admin_branch(x_admin_key); as_of = datetime.utcnow()
+    if since is not None: since = since.replace(tzinfo=None) - timedelta(seconds=10)  # overlap: cells are absolute, re-sending is harmless
+    return {"branch": admin_branch, "as_of": as_of.isoformat(), "incremental": since is not None, **queries.branch_matrix(db, admin_branch, since)}
 @app.get("/teacher-subjects")
-async def get_ts(teacher_id: int, db: Session = Depends(database.get_db)): return db.query(models.Subject).filter_by(teacher_id=teacher_id).all()
+def get_ts(teacher_id: int, request: Request, db: Session = Depends(database.get_db)): return response_cache.cached(request, ("teacher-subjects", teacher_id), lambda: db.query(models.Subject).filter_by(teacher_id=teacher_id).all())
 @app.get("/verify-teacher-pin")
-async def verify_pin(teacher_id: int, entered_pin: str, db: Session = Depends(database.get_db)):
+def verify_pin(teacher_id: int, entered_pin: str, db: Session = Depends(database.get_db)):
     t = db.query(models.Teacher).filter(models.Teacher.id == teacher_id).first()
     if t and t.pin == entered_pin: return {"status": "success", "role": t.role}
     raise HTTPException(status_code=401)
+def require_teacher(db: Session, subject_id: int, teacher_id: int, pin: str):
+    # QR sessions can only be driven by the subject's own teacher
+    sub = db.get(models.Subject, subject_id); t = db.get(models.Teacher, teacher_id)
+    if not sub or not t or t.pin != pin or sub.teacher_id != t.id: raise HTTPException(status_code=401, detail="Teacher PIN required")
+    return sub
 @app.get("/generate-qr-string")
-async def generate_qr(subject_id: int, is_new: bool = False, db: Session = Depends(database.get_db)):
+def generate_qr(subject_id: int, teacher_id: int, x_teacher_pin: str = Header(...), is_new: bool = False, session_id: str = None, db: Session = Depends(database.get_db)):
+    # is_new starts a TOTP session (teacher renders codes locally); session_id alone is the polling fallback
+    sub = require_teacher(db, subject_id, teacher_id, x_teacher_pin)
     if is_new:
-        sub = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
-        if sub: sub.total_lectures_held = (sub.total_lectures_held or 0) + 1; db.commit()
-    active_sessions[subject_id] = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-    return {"current_qr_string": active_sessions[subject_id]}
+        sub.total_lectures_held = (sub.total_lectures_held or 0) + 1; db.commit(); response_cache.invalidate("erp"); response_cache.invalidate("teacher-subjects", sub.teacher_id)
+        return session_engine.start_session(db, subject_id)
+    if not session_id: raise HTTPException(status_code=400, detail="session_id required")
+    if not session_engine.session_open(db, subject_id, session_id): raise HTTPException(status_code=410, detail="Session closed")
+    return {"current_qr_string": session_engine.current_qr(subject_id, session_id)}
+@app.post("/renew-session")
+def renew_session(subject_id: int, session_id: str, teacher_id: int, x_teacher_pin: str = Header(...), db: Session = Depends(database.get_db)):
+    require_teacher(db, subject_id, teacher_id, x_teacher_pin)
+    if not session_engine.renew_session(db, subject_id, session_id): raise HTTPException(status_code=410, detail="Session closed")
+    return {"status": "renewed", "ttl": session_engine.QR_SESSION_TTL}
 @app.post("/stop-session")
-async def stop_session(subject_id: int): active_sessions.pop(subject_id, None); return {"status": "stopped"}
+def stop_session(subject_id: int, teacher_id: int, x_teacher_pin: str = Header(...), session_id: str = None, db: Session = Depends(database.get_db)):
+    require_teacher(db, subject_id, teacher_id, x_teacher_pin)
+    return {"status": "stopped", "sessions": session_engine.stop_sessions(db, subject_id, session_id)}
 @app.get("/live-attendance")
-async def get_live(subject_id: int, db: Session = Depends(database.get_db)):
-    records = db.query(models.Attendance).filter(models.Attendance.subject_id == subject_id).order_by(models.Attendance.id.desc()).limit(10).all()
-    res = []
-    for r in records:
-        s = db.query(models.Student).filter(models.Student.roll_no == r.student_roll).first()
-        if s: res.append({"name": s.name, "roll_no": s.roll_no, "branch": s.branch, "year": s.year, "section": s.section})
-    return res
+def get_live(subject_id: int, db: Session = Depends(database.get_db)):
+    return queries.live_attendance(db, subject_id)
 @app.get("/subject-roster")
-async def get_roster(subject_id: int, db: Session = Depends(database.get_db)):
-    sub = db.query(models.Subject).filter_by(id=subject_id).first()
-    if sub.branch == "ALL": students = db.query(models.Student).filter_by(year=sub.year, section=sub.section, status="Approved").all()
-    else: students = db.query(models.Student).filter_by(branch=sub.branch, year=sub.year, section=sub.section, status="Approved").all()
-    roster = []
-    for s in students:
-        m = db.query(models.ExamMarks).filter_by(student_roll=s.roll_no, subject_id=sub.id).first()
-        att = db.query(models.Attendance).filter_by(student_roll=s.roll_no, subject_id=sub.id).count()
-        roster.append({"name": s.name, "roll_no": s.roll_no, "s1": m.sessional_1 if m else 0, "s2": m.sessional_2 if m else 0, "put": m.put_marks if m else 0, "attended": att})
-    return {"roster": roster, "total_held": sub.total_lectures_held or 0, "filename_data": f"{sub.branch}_Year{sub.year}_Sec{sub.section}_{sub.code}"}
+async def get_roster(subject_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    sub = await db.get(models.Subject, subject_id)
+    return {"roster": await queries.subject_roster(db, sub), "total_held": sub.total_lectures_held or 0, "filename_data": f"{sub.branch}_Year{sub.year}_Sec{sub.section}_{sub.code}"}
 @app.post("/update-marks")
-async def update_m(roll_no: str, subject_id: int, s1: float, s2: float, put: float, db: Session = Depends(database.get_db)):
-    m = db.query(models.ExamMarks).filter_by(student_roll=roll_no, subject_id=subject_id).first()
-    if not m: m = models.ExamMarks(student_roll=roll_no, subject_id=subject_id); db.add(m)
-    if s1 > 0: m.sessional_1 = s1; 
-    if s2 > 0: m.sessional_2 = s2; 
-    if put > 0: m.put_marks = put; 
-    db.commit(); return {"message": "Saved"}
+def update_m(roll_no: str, subject_id: int, s1: float = Query(ge=0, le=marks.MARKS_MAX, allow_inf_nan=False), s2: float = Query(ge=0, le=marks.MARKS_MAX, allow_inf_nan=False), put: float = Query(ge=0, le=marks.MARKS_MAX, allow_inf_nan=False), db: Session = Depends(database.get_db)):
+    marks.upsert_marks(db, subject_id, [marks.MarkEntry(roll_no=roll_no, s1=s1, s2=s2, put=put)]); db.commit(); response_cache.invalidate("erp", roll_no); return {"message": "Saved"}
+@app.post("/update-marks-batch")
+def update_marks_batch(batch: marks.MarksBatch, db: Session = Depends(database.get_db)):
+    # A whole column or grid for one subject: validated up front, then one upsert and one commit
+    sub = db.get(models.Subject, batch.subject_id)
+    if not sub: raise HTTPException(status_code=404, detail="Subject not found")
+    unknown = marks.unknown_rolls(db, sub, {e.roll_no for e in batch.marks})
+    if unknown: raise HTTPException(status_code=422, detail={"message": "Students not in this subject's class", "roll_nos": unknown[:50]})
+    saved = marks.upsert_marks(db, sub.id, batch.marks); db.commit()
+    for roll_no in {e.roll_no for e in batch.marks}: response_cache.invalidate("erp", roll_no)
+    return {"message": "Saved", "saved": saved}
 @app.get("/get-timetable")
-async def get_tt(group_id: str, db: Session = Depends(database.get_db)):
-    tt = db.query(models.Timetable).filter_by(branch_year=group_id).first()
-    return {"exists": True, "grid_data": tt.grid_data} if tt else {"exists": False}
+def get_tt(group_id: str, request: Request, db: Session = Depends(database.get_db)):
+    def build():
+        tt = db.query(models.Timetable).filter_by(branch_year=group_id).first()
+        return {"exists": True, "grid_data": tt.grid_data} if tt else {"exists": False}
+    return response_cache.cached(request, ("timetable", group_id), build)
 @app.post("/save-timetable")
-async def save_tt(group_id: str, grid_data: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
+def save_tt(group_id: str, grid_data: str, x_admin_key: str = Header(...), db: Session = Depends(database.get_db)):
     tt = db.query(models.Timetable).filter_by(branch_year=group_id).first()
     if not tt: db.add(models.Timetable(branch_year=group_id, grid_data=grid_data))
     else: tt.grid_data = grid_data
-    db.commit(); return {"status": "success"}
\ No newline at end of file
+    db.commit(); response_cache.invalidate("timetable", group_id); return {"status": "success"}
+@app.get("/cache-stats")
+def cache_stats(): return response_cache.stats()
+@app.get("/metrics")
+async def get_metrics(): return PlainTextResponse(metrics.render(manager, response_cache), media_type="text/plain; version=0.0.4")
\ No newline at end of file
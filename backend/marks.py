@@ -0,0 +1,54 @@
+import os
+from typing import List
+from pydantic import BaseModel, Field
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.orm import Session
+
+from . import database, models
+from .queries import class_students_filter
+
+# --- BULK MARKS ENTRY: ONE UPSERT PER COLUMN/GRID, BACKED BY A UNIQUE (student_roll, subject_id) INDEX ---
+MARKS_BATCH_LIMIT = int(os.getenv("MARKS_BATCH_LIMIT", "2000"))
+MARKS_MAX = float(os.getenv("MARKS_MAX", "100"))  # highest value any single mark cell accepts
+FIELDS = {"s1": "sessional_1", "s2": "sessional_2", "put": "put_marks"}
+
+class MarkEntry(BaseModel):
+    roll_no: str
+    # 0 means "leave the stored value"; NaN/Infinity would be stored and then break every JSON read of the cell
+    s1: float = Field(0, ge=0, le=MARKS_MAX, allow_inf_nan=False)
+    s2: float = Field(0, ge=0, le=MARKS_MAX, allow_inf_nan=False)
+    put: float = Field(0, ge=0, le=MARKS_MAX, allow_inf_nan=False)
+
+class MarksBatch(BaseModel):
+    subject_id: int
+    marks: List[MarkEntry] = Field(..., max_length=MARKS_BATCH_LIMIT)
+
+def unknown_rolls(db: Session, sub: models.Subject, rolls):
+    # Marks only go to approved students of the subject's own class; anything else rejects the whole batch
+    found = set(db.scalars(select(models.Student.roll_no).where(models.Student.roll_no.in_(list(rolls)), *class_students_filter(sub))))
+    return sorted(set(rolls) - found)
+
+def upsert_marks(db: Session, subject_id: int, entries):
+    # Same rule as the per-cell editor always had: a value only overwrites when > 0; later entries for a roll win
+    rows = {}
+    for e in entries:
+        row = rows.setdefault(e.roll_no, {"student_roll": e.roll_no, "subject_id": subject_id, **{col: 0 for col in FIELDS.values()}})
+        for field, col in FIELDS.items():
+            if getattr(e, field) > 0: row[col] = getattr(e, field)
+    if not rows: return 0
+    M = models.ExamMarks
+    keep = lambda new: {**{col: case((new[col] > 0, new[col]), else_=getattr(M, col)) for col in FIELDS.values()}, "updated_at": func.now()}
+    database.upsert(db, M, list(rows.values()), ["student_roll", "subject_id"], set_=keep)
+    return len(rows)
+
+def dedupe(engine):
+    # Pre-constraint deployments may hold several rows per (student, subject): fold each group into its oldest row
+    # (max per column, which is what every read path already showed) so the unique index can be built
+    M = models.ExamMarks
+    with engine.begin() as conn:
+        dups = conn.execute(select(M.student_roll, M.subject_id, func.min(M.id), func.max(M.sessional_1), func.max(M.sessional_2), func.max(M.put_marks))
+                            .group_by(M.student_roll, M.subject_id).having(func.count() > 1)).all()
+        for roll, subject_id, keep, s1, s2, put in dups:
+            conn.execute(update(M).where(M.id == keep).values(sessional_1=s1, sessional_2=s2, put_marks=put, updated_at=func.now()))
+            conn.execute(delete(M).where(M.student_roll == roll, M.subject_id == subject_id, M.id != keep))
+    return len(dups)
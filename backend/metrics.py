@@ -0,0 +1,130 @@
+import contextvars, logging, os, threading, time
+from collections import defaultdict
+from sqlalchemy import event
+
+from . import database
+
+# --- PER-REQUEST INSTRUMENTATION + PROMETHEUS TEXT EXPOSITION (no client library needed) ---
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # > 0 logs the SQL behind any request slower than this
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+slow_log = logging.getLogger("knmiet.slow_requests")
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: tuple, buckets: tuple):
+        self.name = name; self.doc = doc; self.labels = labels; self.buckets = buckets
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+    def observe(self, values: tuple, amount: float):
+        s = self.series.get(values)
+        if s is None: s = self.series[values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if amount <= bound: s[i] += 1
+        s[-2] += amount; s[-1] += 1
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"; yield f"# TYPE {self.name} histogram"
+        for values, s in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, s):
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), values + (bound,))} {count}"
+            yield f"{self.name}_bucket{_labels(self.labels + ('le',), values + ('+Inf',))} {s[-1]}"
+            yield f"{self.name}_sum{_labels(self.labels, values)} {s[-2]}"; yield f"{self.name}_count{_labels(self.labels, values)} {s[-1]}"
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple, kind: str = "counter"):
+        self.name = name; self.doc = doc; self.labels = labels; self.kind = kind; self.series = defaultdict(float)
+    def inc(self, values: tuple, amount: float = 1): self.series[values] += amount
+    def render(self):
+        yield f"# HELP {self.name} {self.doc}"; yield f"# TYPE {self.name} {self.kind}"
+        for values, v in sorted(self.series.items()): yield f"{self.name}{_labels(self.labels, values)} {v}"
+
+def _labels(names, values):
+    if not names: return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{n}="{escape(v)}"' for n, v in zip(names, values)) + "}"
+
+class RequestStats:
+    __slots__ = ("statements", "db_time", "log", "started")
+    def __init__(self, capture: bool): self.statements = 0; self.db_time = 0.0; self.log = [] if capture else None; self.started = {}
+
+current_request = contextvars.ContextVar("current_request", default=None)
+lock = threading.Lock()
+request_latency = Histogram("knmiet_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"), LATENCY_BUCKETS)
+requests_total = Counter("knmiet_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+statements_per_request = Histogram("knmiet_db_statements_per_request", "SQL statements issued per request; creeping counts flag N+1 regressions.", ("route",), STATEMENT_BUCKETS)
+statements_total = Counter("knmiet_db_statements_total", "SQL statements by route (background = batch writer and other non-request work).", ("route",))
+db_time_total = Counter("knmiet_db_time_seconds_total", "Time spent executing SQL by route.", ("route",))
+pool_wait = Histogram("knmiet_db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection.", ("engine",), LATENCY_BUCKETS)
+slow_requests = Counter("knmiet_slow_requests_total", "Requests slower than SLOW_REQUEST_MS.", ("route",))
+
+# --- SQLALCHEMY HOOKS ---
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get()
+    if stats is not None: stats.started[id(cursor)] = time.perf_counter()
+    else: conn.info["metrics_started"] = time.perf_counter()
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_request.get(); now = time.perf_counter()
+    if stats is None:
+        elapsed = now - conn.info.pop("metrics_started", now)
+        with lock: statements_total.inc(("background",)); db_time_total.inc(("background",), elapsed)
+        return
+    elapsed = now - stats.started.pop(id(cursor), now)
+    stats.statements += 1; stats.db_time += elapsed
+    if stats.log is not None: stats.log.append((round(elapsed * 1000, 2), " ".join(statement.split())[:500]))
+
+def _observe_pool_wait(label: str, seconds: float):
+    with lock: pool_wait.observe((label,), seconds)
+
+def instrument_engines():
+    for eng in (database.engine, database.async_engine.sync_engine):
+        event.listen(eng, "before_cursor_execute", _before_execute); event.listen(eng, "after_cursor_execute", _after_execute)
+    database.pool_wait_observers.append(_observe_pool_wait)
+
+# --- ASGI MIDDLEWARE ---
+def _route_label(scope):
+    route = scope.get("route")
+    if route is not None: return route.path
+    return scope.get("root_path") or "unmatched"  # static mounts collapse to their prefix; 404s share one label
+
+class MetricsMiddleware:
+    def __init__(self, app): self.app = app
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http": return await self.app(scope, receive, send)
+        stats = RequestStats(SLOW_REQUEST_MS > 0); token = current_request.set(stats)
+        status = {"code": 500}; start = time.perf_counter()
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": status["code"] = message["status"]
+            await send(message)
+        try: await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - start; route = _route_label(scope); method = scope["method"]
+            with lock:
+                request_latency.observe((method, route), elapsed); requests_total.inc((method, route, status["code"]))
+                statements_per_request.observe((route,), stats.statements); statements_total.inc((route,), stats.statements); db_time_total.inc((route,), stats.db_time)
+                if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS: slow_requests.inc((route,))
+            if SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS:
+                slow_log.warning("slow request %s %s %.1fms status=%s statements=%d db=%.1fms query=%s\n%s", method, route, elapsed * 1000, status["code"], stats.statements,
+                                 stats.db_time * 1000, scope.get("query_string", b"").decode("latin-1"), "\n".join(f"  [{ms}ms] {sql}" for ms, sql in stats.log))
+
+# --- EXPOSITION ---
+def _gauge(name, doc, labels, series, kind="gauge"):
+    c = Counter(name, doc, labels, kind)
+    for values, v in series: c.inc(values, v)
+    return c.render()
+
+def render(manager=None, cache=None):
+    with lock:
+        lines = [line for metric in (request_latency, requests_total, statements_per_request, statements_total, db_time_total, pool_wait, slow_requests) for line in metric.render()]
+    pools = (("sync", database.engine.pool), ("async", database.async_engine.sync_engine.pool))
+    lines += _gauge("knmiet_db_pool_checked_out", "Connections currently checked out.", ("engine",), [((label,), pool.checkedout()) for label, pool in pools if hasattr(pool, "checkedout")])
+    if manager is not None:
+        lines += _gauge("knmiet_ws_connections", "Open live-attendance WebSockets per subject.", ("subject_id",), [((sid,), len(c)) for sid, c in list(manager.active_connections.items())])
+        lines += _gauge("knmiet_ws_frames_sent_total", "WebSocket frames sent per subject.", ("subject_id",), [((sid,), n) for sid, n in list(manager.frames_sent.items())], "counter")
+        lines += _gauge("knmiet_ws_events_sent_total", "Scan events delivered over WebSockets per subject.", ("subject_id",), [((sid,), n) for sid, n in list(manager.events_sent.items())], "counter")
+        lines += _gauge("knmiet_ws_evictions_total", "Slow or broken WebSocket clients evicted.", (), [((), manager.evictions)], "counter")
+    if cache is not None:
+        stats = cache.stats()
+        for key in ("hits", "misses", "not_modified", "invalidations", "evictions"):
+            lines += _gauge(f"knmiet_cache_{key}_total", f"Response cache {key.replace('_', ' ')}.", (), [((), stats[key])], "counter")
+        lines += _gauge("knmiet_cache_entries", "Response cache entries.", (), [((), stats["entries"])])
+    return "\n".join(lines) + "\n"
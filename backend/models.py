@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, Date, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -14,6 +14,8 @@ class Student(Base):
     registered_device = Column(String)
     status = Column(String, default="Pending") 
     total_lectures = Column(Integer, default=0)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now())  # new/approved/rejected students reach analytics deltas; default= because migrated columns have no DB default
+    __table_args__ = (Index("ix_students_class", "branch", "year", "section", "status"),)
 
 class Teacher(Base):
     __tablename__ = "teachers"
@@ -35,12 +37,30 @@ class Subject(Base):
     teacher_id = Column(Integer)
     total_lectures_held = Column(Integer, default=0)
 
+class QrSession(Base):
+    # One row per QR attendance session; scans are only accepted while expires_at (epoch seconds) is in the future
+    __tablename__ = "qr_sessions"
+    session_id = Column(String, primary_key=True)
+    subject_id = Column(Integer, nullable=False)
+    expires_at = Column(Float, nullable=False)
+
 class Attendance(Base):
     __tablename__ = "attendance"
     id = Column(Integer, primary_key=True, index=True)
     student_roll = Column(String, index=True)
     subject_id = Column(Integer, index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
+    # Composite indexes for the set-based roster/ERP aggregates and the 40-minute duplicate check
+    __table_args__ = (Index("ix_attendance_roll_subject_ts", "student_roll", "subject_id", "timestamp"), Index("ix_attendance_subject_roll", "subject_id", "student_roll"))
+
+class AttendanceDaily(Base):
+    # Per-(student, day) rollup appended to on every scan write; backs the paginated history view
+    __tablename__ = "attendance_daily"
+    id = Column(Integer, primary_key=True, index=True)
+    student_roll = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    subject_ids = Column(String, nullable=False, default="")  # comma-separated, one entry per scan, oldest first
+    __table_args__ = (UniqueConstraint("student_roll", "day", name="uq_attendance_daily_roll_day"),)  # also the keyset index
 
 class ExamMarks(Base):
     __tablename__ = "exam_marks"
@@ -50,6 +70,8 @@ class ExamMarks(Base):
     sessional_1 = Column(Float, default=0)
     sessional_2 = Column(Float, default=0)
     put_marks = Column(Float, default=0)
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(), onupdate=func.now())  # drives incremental analytics refresh
+    __table_args__ = (Index("uq_exam_marks_roll_subject", "student_roll", "subject_id", unique=True),)  # one row per cell; target of the marks upsert
 
 class Timetable(Base):
     __tablename__ = "timetable"
@@ -64,4 +86,5 @@ class LeaveRequest(Base):
     student_roll = Column(String, index=True)
     date_req = Column(String)
     reason = Column(String)
-    status = Column(String, default="Pending")
\ No newline at end of file
+    status = Column(String, default="Pending")
+    __table_args__ = (Index("ix_leave_requests_status_roll", "status", "student_roll"),)
\ No newline at end of file
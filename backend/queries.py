@@ -0,0 +1,117 @@
+import os
+from datetime import date, datetime
+from sqlalchemy import and_, func, or_, select, union
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+# --- SET-BASED READ QUERIES: ONE AGGREGATE STATEMENT PER PAYLOAD, NO PER-ROW LOOKUPS ---
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "60"))  # days per /student-attendance-history page
+HISTORY_MAX_PAGE = 366
+
+def _marks(*filters):
+    # One marks row per (student, subject); max() also tolerates legacy duplicate rows
+    m = models.ExamMarks
+    return select(m.student_roll, m.subject_id, func.max(m.sessional_1).label("s1"), func.max(m.sessional_2).label("s2"), func.max(m.put_marks).label("put")).where(*filters).group_by(m.student_roll, m.subject_id).subquery()
+
+def _attendance_counts(*filters):
+    a = models.Attendance
+    return select(a.student_roll, a.subject_id, func.count().label("attended")).where(*filters).group_by(a.student_roll, a.subject_id).subquery()
+
+def class_students_filter(sub: models.Subject):
+    f = [models.Student.year == sub.year, models.Student.section == sub.section, models.Student.status == "Approved"]
+    if sub.branch != "ALL": f.append(models.Student.branch == sub.branch)
+    return f
+
+def student_subjects_filter(s: models.Student):
+    return [or_(models.Subject.branch == s.branch, models.Subject.branch == "ALL"), models.Subject.year == s.year, models.Subject.section == s.section]
+
+async def subject_roster(db: AsyncSession, sub: models.Subject):
+    att = _attendance_counts(models.Attendance.subject_id == sub.id); m = _marks(models.ExamMarks.subject_id == sub.id)
+    rows = await db.execute(select(models.Student.name, models.Student.roll_no, m.c.s1, m.c.s2, m.c.put, func.coalesce(att.c.attended, 0))
+                      .outerjoin(att, att.c.student_roll == models.Student.roll_no).outerjoin(m, m.c.student_roll == models.Student.roll_no)
+                      .where(*class_students_filter(sub)).order_by(models.Student.id))
+    return [{"name": name, "roll_no": roll, "s1": s1 or 0, "s2": s2 or 0, "put": put or 0, "attended": attended} for name, roll, s1, s2, put, attended in rows]
+
+async def student_subjects(db: AsyncSession, s: models.Student):
+    att = _attendance_counts(models.Attendance.student_roll == s.roll_no); m = _marks(models.ExamMarks.student_roll == s.roll_no)
+    rows = await db.execute(select(models.Subject.name, models.Subject.code, models.Subject.total_lectures_held, func.coalesce(att.c.attended, 0), m.c.s1, m.c.s2, m.c.put)
+                      .outerjoin(att, att.c.subject_id == models.Subject.id).outerjoin(m, m.c.subject_id == models.Subject.id)
+                      .where(*student_subjects_filter(s)).order_by(models.Subject.id))
+    return [{"subject_name": name, "code": code, "attended": attended, "total_held": held or 0, "s1": s1 or 0, "s2": s2 or 0, "put": put or 0} for name, code, held, attended, s1, s2, put in rows]
+
+def pending_leaves(db: Session, admin_branch: str):
+    q = select(models.LeaveRequest.id, models.Student.name, models.Student.roll_no, models.LeaveRequest.date_req, models.LeaveRequest.reason).join(models.Student, models.Student.roll_no == models.LeaveRequest.student_roll).where(models.LeaveRequest.status == "Pending")
+    if admin_branch != "ALL": q = q.where(models.Student.branch == admin_branch)
+    return [{"id": i, "name": name, "roll_no": roll, "date_req": d, "reason": r} for i, name, roll, d, r in db.execute(q.order_by(models.LeaveRequest.id))]
+
+def live_attendance(db: Session, subject_id: int, limit: int = 10):
+    rows = db.execute(select(models.Student.name, models.Student.roll_no, models.Student.branch, models.Student.year, models.Student.section)
+                      .join(models.Attendance, models.Attendance.student_roll == models.Student.roll_no)
+                      .where(models.Attendance.subject_id == subject_id).order_by(models.Attendance.id.desc()).limit(limit))
+    return [{"name": name, "roll_no": roll, "branch": b, "year": y, "section": sec} for name, roll, b, y, sec in rows]
+
+def branch_matrix(db: Session, admin_branch: str, since=None):
+    # Whole branch as columns: students x subjects, with only the cells that apply (a student's own section)
+    S, J, A, M = models.Student, models.Subject, models.Attendance, models.ExamMarks
+    sf = [] if admin_branch == "ALL" else [S.branch == admin_branch]
+    rolls = select(S.roll_no).where(*sf)
+    att_f, marks_f = [A.student_roll.in_(rolls)], [M.student_roll.in_(rolls)]
+    if since is not None:
+        # Incremental refresh: (student, subject) pairs with a scan or a marks edit since the last pull, plus every
+        # cell of students registered, approved, rejected or otherwise edited since then
+        changed = union(select(A.student_roll.label("roll"), A.subject_id).where(A.timestamp >= since), select(M.student_roll, M.subject_id).where(M.updated_at >= since)).subquery()
+        changed_rolls = union(select(changed.c.roll), select(S.roll_no).where(S.updated_at >= since))
+        sf.append(S.roll_no.in_(changed_rolls)); att_f.append(A.student_roll.in_(changed_rolls)); marks_f.append(M.student_roll.in_(changed_rolls))
+    att, m = _attendance_counts(*att_f), _marks(*marks_f)
+    q = (select(S.roll_no, J.id, func.coalesce(att.c.attended, 0), m.c.s1, m.c.s2, m.c.put).select_from(S)
+         .join(J, and_(or_(J.branch == S.branch, J.branch == "ALL"), J.year == S.year, J.section == S.section))
+         .outerjoin(att, and_(att.c.student_roll == S.roll_no, att.c.subject_id == J.id)).outerjoin(m, and_(m.c.student_roll == S.roll_no, m.c.subject_id == J.id))
+         .where(*sf))
+    if since is not None: q = q.outerjoin(changed, and_(changed.c.roll == S.roll_no, changed.c.subject_id == J.id)).where(or_(changed.c.roll.isnot(None), S.updated_at >= since))
+
+    students = {"roll_no": [], "name": [], "branch": [], "year": [], "section": [], "status": [], "total_lectures": []}
+    for row in db.execute(select(S.roll_no, S.name, S.branch, S.year, S.section, S.status, S.total_lectures).where(*sf).order_by(S.id)):
+        for k, v in zip(students, row): students[k].append(v)
+    subjects = {"id": [], "name": [], "code": [], "branch": [], "year": [], "section": [], "total_held": []}
+    jq = select(J.id, J.name, J.code, J.branch, J.year, J.section, func.coalesce(J.total_lectures_held, 0))
+    if admin_branch != "ALL": jq = jq.where(J.branch.in_([admin_branch, "ALL"]))
+    for row in db.execute(jq.order_by(J.id)):
+        for k, v in zip(subjects, row): subjects[k].append(v)
+
+    s_idx = {r: i for i, r in enumerate(students["roll_no"])}; j_idx = {j: i for i, j in enumerate(subjects["id"])}
+    cells = {"student": [], "subject": [], "attended": [], "s1": [], "s2": [], "put": []}
+    for roll, sub_id, attended, s1, s2, put in db.execute(q.order_by(S.id, J.id)):
+        if sub_id not in j_idx: continue
+        cells["student"].append(s_idx[roll]); cells["subject"].append(j_idx[sub_id]); cells["attended"].append(attended)
+        cells["s1"].append(s1 or 0); cells["s2"].append(s2 or 0); cells["put"].append(put or 0)
+    return {"students": students, "subjects": subjects, "cells": cells}
+
+def _leave_day(date_req: str):
+    # Leave dates are stored the way student.html submits them: dd-mm-yy
+    try: return datetime.strptime(date_req, "%d-%m-%y").date()
+    except (TypeError, ValueError): return None
+
+def attendance_history(db: Session, roll_no: str, start: date = None, end: date = None, before: date = None, limit: int = HISTORY_PAGE_SIZE):
+    # Keyset page over the daily rollup, newest day first; `before` is the next_cursor of the previous page
+    student = db.scalar(select(models.Student).where(models.Student.roll_no == roll_no))
+    if student is None: return None
+    limit = max(1, min(limit, HISTORY_MAX_PAGE)); D = models.AttendanceDaily
+    subjects = db.execute(select(models.Subject.id, models.Subject.code).where(*student_subjects_filter(student)).order_by(models.Subject.id)).all()
+    q = select(D.day, D.subject_ids).where(D.student_roll == roll_no)
+    if start is not None: q = q.where(D.day >= start)
+    if end is not None: q = q.where(D.day <= end)
+    if before is not None: q = q.where(D.day < before)
+    rows = db.execute(q.order_by(D.day.desc()).limit(limit + 1)).all()
+    more = len(rows) > limit; rows = rows[:limit]
+    days = {day: [int(i) for i in ids.split(",") if i] for day, ids in rows}
+
+    # Approved leaves without a scan still get a row; only those inside this page's window (small per student)
+    lower = rows[-1].day if more else start; leaves = []
+    for (date_req,) in db.execute(select(models.LeaveRequest.date_req).where(models.LeaveRequest.student_roll == roll_no, models.LeaveRequest.status == "Approved")):
+        day = _leave_day(date_req)
+        if day is None or (lower is not None and day < lower) or (end is not None and day > end) or (before is not None and day >= before): continue
+        leaves.append(date_req); days.setdefault(day, [])
+    return {"subjects": [{"id": i, "code": code} for i, code in subjects], "history": {day.strftime("%d-%m-%y"): days[day] for day in sorted(days, reverse=True)},
+            "approved_leaves": leaves, "next_cursor": rows[-1].day.isoformat() if more else None}
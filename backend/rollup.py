@@ -0,0 +1,39 @@
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import database, models
+
+# --- DAILY ATTENDANCE ROLLUP: ONE ROW PER (STUDENT, DAY), MAINTAINED IN THE SAME TRANSACTION AS THE SCAN ---
+BACKFILL_CHUNK_SIZE = 1000
+
+def utc_day(ts: datetime = None) -> date:
+    # Attendance timestamps come from the DB clock (UTC on the server); history days have always been UTC days
+    if ts is None: return datetime.now(timezone.utc).date()
+    return (ts.astimezone(timezone.utc) if ts.tzinfo else ts).date()
+
+def record_scans(db: Session, keys, day: date = None):
+    # keys: (roll_no, subject_id) pairs written in this transaction; one upsert row per student
+    day = day or utc_day(); per_roll = defaultdict(list)
+    for roll_no, subject_id in keys: per_roll[roll_no].append(str(subject_id))
+    rows = [{"student_roll": roll, "day": day, "subject_ids": ",".join(ids)} for roll, ids in per_roll.items()]
+    database.upsert(db, models.AttendanceDaily, rows, ["student_roll", "day"], set_=lambda new: {"subject_ids": models.AttendanceDaily.subject_ids + "," + new["subject_ids"]})
+
+def backfill(engine):
+    # One-off build from the raw attendance log for deployments that predate the rollup
+    with Session(engine) as db:
+        if db.scalar(select(models.AttendanceDaily.id).limit(1)) is not None or db.scalar(select(models.Attendance.id).limit(1)) is None: return 0
+        a = models.Attendance; rows, current, written = [], None, 0
+        stream = db.execute(select(a.student_roll, a.subject_id, a.timestamp).order_by(a.student_roll, a.timestamp, a.id).execution_options(yield_per=5000))
+        for roll_no, subject_id, ts in stream:
+            key = (roll_no, utc_day(ts))
+            if key != current: current = key; rows.append({"student_roll": roll_no, "day": key[1], "subject_ids": str(subject_id)})
+            else: rows[-1]["subject_ids"] += f",{subject_id}"
+            if len(rows) > BACKFILL_CHUNK_SIZE: db.execute(insert(models.AttendanceDaily).values(rows[:-1])); written += len(rows) - 1; rows = rows[-1:]
+        stream.close()
+        if rows: db.execute(insert(models.AttendanceDaily).values(rows)); written += len(rows)
+        try: db.commit()
+        except IntegrityError: db.rollback(); return 0  # another worker got there first
+        return written
@@ -0,0 +1,61 @@
+import codecs, csv, os
+from sqlalchemy.orm import Session
+
+from . import database, models
+
+# --- STREAMING ROSTER IMPORT: PARSE AS WE GO, ONE BULK INSERT + COMMIT PER CHUNK ---
+ROSTER_CHUNK_SIZE = int(os.getenv("ROSTER_CHUNK_SIZE", "500"))
+MAX_REJECTIONS = 1000  # the report is capped so a junk file can't grow the response without bound
+
+def map_columns(fieldnames):
+    # Resolved once per file from the header, same keyword matching the per-row lookup used to do
+    def find(word): return next((k for k in fieldnames or [] if k and word in k.lower()), None)
+    return {"roll": find("roll"), "name": find("name"), "branch": find("branch"), "year": find("year"), "sec": find("sec")}
+
+def parse_row(row: dict, cols: dict, admin_branch: str):
+    # -> (student values, None) or (None, rejection reason)
+    def val(key): return str(row.get(cols[key]) or "").strip()
+    roll_no = val("roll") if cols["roll"] else ""
+    if not roll_no: return None, "missing roll number"
+    branch = val("branch").upper() if cols["branch"] else "CSE"
+    if admin_branch != "ALL" and branch != admin_branch: return None, f"branch {branch} outside {admin_branch}"
+    try: year = int(val("year")) if cols["year"] else 1
+    except ValueError: return None, f"invalid year {val('year')!r}"
+    section = val("sec").upper().replace("SEC ", "").replace("SECTION ", "") if cols["sec"] else "A"
+    # erp_id stays NULL until the student links a device: a shared placeholder would trip the unique index on erp_id
+    return {"erp_id": None, "roll_no": roll_no, "name": val("name") if cols["name"] else "Unknown", "branch": branch, "year": year, "section": section,
+            "registered_device": "UNREGISTERED", "status": "Approved", "total_lectures": 0}, None
+
+def insert_chunk(db: Session, rows: list):
+    # INSERT ... ON CONFLICT (roll_no) DO NOTHING RETURNING roll_no: already-registered rolls come back missing
+    inserted = set(database.upsert(db, models.Student, rows, ["roll_no"], returning=models.Student.roll_no))
+    db.commit()
+    return inserted
+
+def import_roster(fileobj, admin_branch: str, db: Session, chunk_size: int = ROSTER_CHUNK_SIZE):
+    reader = csv.DictReader(codecs.iterdecode(fileobj, "utf-8-sig"))
+    cols = map_columns(reader.fieldnames)
+    chunks, rejections = [], []; totals = {"rows": 0, "inserted": 0, "rejected": 0}
+
+    def reject(line, roll_no, reason):
+        totals["rejected"] += 1
+        if len(rejections) < MAX_REJECTIONS: rejections.append({"line": line, "roll_no": roll_no, "reason": reason})
+
+    def flush(batch):
+        if not batch: return
+        inserted = insert_chunk(db, [values for _, values in batch])
+        for line, values in batch:
+            if values["roll_no"] not in inserted: reject(line, values["roll_no"], "already registered")
+        totals["inserted"] += len(inserted)
+        chunks.append({"chunk": len(chunks) + 1, "rows_read": totals["rows"], "inserted": len(inserted), "total_inserted": totals["inserted"]})
+
+    batch, seen = [], set()
+    for row in reader:
+        totals["rows"] += 1; line = reader.line_num
+        values, reason = parse_row(row, cols, admin_branch)
+        if values is None: reject(line, str(row.get(cols["roll"]) or "").strip() if cols["roll"] else "", reason); continue
+        if values["roll_no"] in seen: reject(line, values["roll_no"], "duplicate in file"); continue
+        seen.add(values["roll_no"]); batch.append((line, values))
+        if len(batch) >= chunk_size: flush(batch); batch, seen = [], set()
+    flush(batch)
+    return {"message": f"Successfully pre-approved {totals['inserted']} students!", **totals, "chunks": chunks, "rejections": rejections}
@@ -0,0 +1,74 @@
+import base64, hashlib, hmac, os, secrets, time
+import pyotp
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+# --- STATELESS TOTP QR SESSIONS: ANY WORKER CAN VALIDATE A SCAN WITH PURE CPU WORK ---
+# Every worker must share QR_MASTER_KEY; per-session secrets are derived from it, never stored.
+# There is deliberately no default: anyone holding the key can mint valid codes for any subject.
+QR_MASTER_KEY = os.getenv("QR_MASTER_KEY", "").encode()
+if len(QR_MASTER_KEY) < 16: raise RuntimeError("QR_MASTER_KEY must be set to a secret of at least 16 characters (e.g. python -c 'import secrets; print(secrets.token_hex(32))')")
+QR_STEP = int(os.getenv("QR_STEP", "5"))            # seconds each code is shown
+QR_SKEW = int(os.getenv("QR_SKEW", "1"))            # extra steps accepted on either side
+QR_DIGITS = int(os.getenv("QR_DIGITS", "6"))
+QR_SESSION_TTL = int(os.getenv("QR_SESSION_TTL", "300"))           # lease: the open teacher page renews it every QR_RENEW_EVERY
+QR_RENEW_EVERY = int(os.getenv("QR_RENEW_EVERY", "60"))
+QR_SESSION_MAX = int(os.getenv("QR_SESSION_MAX", str(3 * 3600)))  # hard cap, however often it is renewed
+
+def new_session_id() -> str:
+    # "<start epoch, base 16><4 random hex>" -> the start time travels inside the QR, so expiry needs no lookup
+    return f"{int(time.time()):x}{secrets.token_hex(2)}"
+
+def session_key(subject_id: int, session_id: str) -> bytes:
+    return hmac.new(QR_MASTER_KEY, f"{subject_id}:{session_id}".encode(), hashlib.sha256).digest()[:20]
+
+def session_totp(subject_id: int, session_id: str) -> pyotp.TOTP:
+    return pyotp.TOTP(base64.b32encode(session_key(subject_id, session_id)).decode(), digits=QR_DIGITS, interval=QR_STEP)
+
+def session_started(session_id: str):
+    try: return int(session_id[:-4], 16)
+    except ValueError: return None
+
+def current_qr(subject_id: int, session_id: str) -> str:
+    return f"{session_id}.{session_totp(subject_id, session_id).now()}"
+
+# --- SESSION LIFECYCLE: codes are CPU-checked, but whether a session is still open lives in qr_sessions ---
+def start_session(db: Session, subject_id: int) -> dict:
+    session_id = new_session_id(); now = time.time()
+    db.execute(delete(models.QrSession).where(models.QrSession.expires_at < now - 86400))  # housekeeping
+    db.add(models.QrSession(session_id=session_id, subject_id=subject_id, expires_at=now + QR_SESSION_TTL)); db.commit()
+    # The teacher page gets the key once and renders codes locally, so rotation never hits the API
+    return {"session_id": session_id, "key": session_key(subject_id, session_id).hex(), "step": QR_STEP, "digits": QR_DIGITS, "renew_every": QR_RENEW_EVERY,
+            "server_time": now, "current_qr_string": current_qr(subject_id, session_id)}
+
+def renew_session(db: Session, subject_id: int, session_id: str) -> bool:
+    # Extends an open session's lease; a stopped or lapsed session stays closed
+    started, now = session_started(session_id), time.time()
+    if started is None: return False
+    res = db.execute(update(models.QrSession).where(models.QrSession.session_id == session_id, models.QrSession.subject_id == subject_id, models.QrSession.expires_at > now)
+                     .values(expires_at=min(now + QR_SESSION_TTL, started + QR_SESSION_MAX)))
+    db.commit(); return res.rowcount > 0
+
+def stop_sessions(db: Session, subject_id: int, session_id: str = None) -> int:
+    now = time.time(); q = update(models.QrSession).where(models.QrSession.subject_id == subject_id, models.QrSession.expires_at > now)
+    if session_id: q = q.where(models.QrSession.session_id == session_id)
+    res = db.execute(q.values(expires_at=now)); db.commit(); return res.rowcount
+
+def session_open(db: Session, subject_id: int, session_id: str, now: float = None) -> bool:
+    expires = db.scalar(select(models.QrSession.expires_at).where(models.QrSession.session_id == session_id, models.QrSession.subject_id == subject_id))
+    return expires is not None and expires > (time.time() if now is None else now)
+
+async def session_open_async(db: AsyncSession, subject_id: int, session_id: str, now: float = None) -> bool:
+    expires = await db.scalar(select(models.QrSession.expires_at).where(models.QrSession.session_id == session_id, models.QrSession.subject_id == subject_id))
+    return expires is not None and expires > (time.time() if now is None else now)
+
+def verify_qr(subject_id: int, qr_content: str, now: float = None) -> bool:
+    # Pure CPU: right key, right time window, within the hard cap. Callers also check session_open_async.
+    session_id, _, code = (qr_content or "").partition(".")
+    started = session_started(session_id) if session_id and code else None
+    now = time.time() if now is None else now
+    if started is None or not (started - QR_STEP <= now <= started + QR_SESSION_MAX): return False
+    return session_totp(subject_id, session_id).verify(code, for_time=int(now), valid_window=QR_SKEW)
@@ -0,0 +1,179 @@
+"""Lecture-hour scan storm benchmark.
+
+Seeds a campus (branches x years x sections x students) into a scratch database, then runs the
+FastAPI app in-process and, for many subjects at once, starts a QR session, keeps a live
+WebSocket listener open, polls /generate-qr-string and fires every student's /mark-attendance
+inside a short window. Prints one JSON document (latency percentiles, throughput, DB statement
+counts and error rates per endpoint) that can be diffed between commits.
+
+    python bench/scan_storm.py --out bench_output.txt
+    python bench/scan_storm.py --database-url postgresql://postgres@localhost/bench_db
+
+The target database is dropped and re-seeded: never point it at a real deployment.
+Needs requirements-dev.txt on top of requirements.txt: httpx for the ASGI transport and, for the
+default SQLite run, aiosqlite (the async engine imports it for sqlite URLs).
+"""
+import argparse, asyncio, contextvars, json, os, random, secrets, subprocess, sys, tempfile, time
+from collections import defaultdict
+
+BRANCHES = ["CSE", "IT", "AI", "ECE", "EE", "CHE"]
+SECTIONS = "ABCDEFGH"
+TEACHER_PIN = "2468"; TEACHER = {"X-Teacher-Pin": TEACHER_PIN}
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    p.add_argument("--database-url", default=None, help="scratch DB (default: fresh SQLite file in a temp dir)")
+    p.add_argument("--branches", type=int, default=6); p.add_argument("--years", type=int, default=4)
+    p.add_argument("--sections", type=int, default=3); p.add_argument("--students", type=int, default=60, help="students per section")
+    p.add_argument("--subjects-per-class", type=int, default=6)
+    p.add_argument("--active-subjects", type=int, default=0, help="subjects holding a lecture at once (default: one per class)")
+    p.add_argument("--window", type=float, default=5.0, help="seconds over which a class's scans arrive")
+    p.add_argument("--seed", type=int, default=42); p.add_argument("--out", default=None)
+    return p.parse_args()
+
+# --- IN-PROCESS ASGI WEBSOCKET CLIENT (keeps the harness free of extra server/WS dependencies) ---
+class ASGIWebSocket:
+    def __init__(self, app, path: str):
+        self.app = app; self.path = path; self.to_app = asyncio.Queue(); self.from_app = asyncio.Queue(); self.task = None
+    async def connect(self):
+        scope = {"type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1", "path": self.path, "raw_path": self.path.encode(),
+                 "root_path": "", "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80), "subprotocols": []}
+        self.task = asyncio.create_task(self.app(scope, self.to_app.get, self.from_app.put))
+        await self.to_app.put({"type": "websocket.connect"})
+        msg = await self.from_app.get()
+        if msg["type"] != "websocket.accept": raise RuntimeError(f"websocket rejected: {msg}")
+    async def receive_json(self):
+        msg = await self.from_app.get()
+        if msg["type"] != "websocket.send": raise ConnectionError(msg["type"])
+        return json.loads(msg.get("text") or msg["bytes"])
+    async def close(self):
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        try: await asyncio.wait_for(self.task, 5)
+        except Exception: pass
+
+def percentile(sorted_values, q):
+    if not sorted_values: return None
+    return sorted_values[min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))]
+
+def git_revision():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception: return None
+
+async def main():
+    args = parse_args(); rng = random.Random(args.seed)
+    tmpdir = None
+    if not args.database_url: tmpdir = tempfile.mkdtemp(prefix="scan-storm-"); args.database_url = f"sqlite:///{tmpdir}/bench.db"
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("QR_MASTER_KEY", secrets.token_hex(32))  # throwaway key for the scratch run
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))); os.chdir(sys.path[0])
+
+    import httpx
+    from sqlalchemy import event, insert
+    from backend import main as app_module, models, database
+
+    # --- SEED ---
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    students, subjects, classes = [], [], []
+    for b in BRANCHES[:args.branches]:
+        for y in range(1, args.years + 1):
+            for sec in SECTIONS[:args.sections]:
+                roster = []
+                for n in range(args.students):
+                    roll = f"{y}{b[:2]}{sec}{n:04d}".ljust(13, "0")
+                    students.append({"erp_id": f"ERP{roll}", "roll_no": roll, "name": f"Student {b}{y}{sec}{n}", "branch": b, "year": y, "section": sec,
+                                     "registered_device": f"DEV-{roll}", "status": "Approved", "total_lectures": 0})
+                    roster.append(roll)
+                class_subjects = []
+                for k in range(args.subjects_per_class):
+                    subjects.append({"id": len(subjects) + 1, "name": f"{b} Subject {k}", "code": f"{b}{y}{sec}{k}", "branch": b, "year": y, "section": sec, "teacher_id": 1, "total_lectures_held": 0})
+                    class_subjects.append(len(subjects))
+                classes.append((class_subjects, roster))
+    with database.engine.begin() as conn:
+        for i in range(0, len(students), 1000): conn.execute(insert(models.Student), students[i:i + 1000])
+        conn.execute(insert(models.Subject), subjects)
+        conn.execute(insert(models.Teacher), [{"id": 1, "name": "Bench Teacher", "email": "bench@knmiet", "pin": TEACHER_PIN, "role": "Prof", "department": "CSE"}])
+
+    # --- STATEMENT ACCOUNTING: attribute each SQL statement to the endpoint whose request issued it ---
+    current_endpoint = contextvars.ContextVar("endpoint", default="(background)")
+    statements = defaultdict(int)
+    def count_statement(*_): statements[current_endpoint.get()] += 1
+    for eng in (database.engine, database.async_engine.sync_engine): event.listen(eng, "before_cursor_execute", count_statement)
+
+    latencies, errors, statuses = defaultdict(list), defaultdict(int), defaultdict(lambda: defaultdict(int))
+    app = app_module.app
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60)
+
+    async def call(method, endpoint, headers=None, **params):
+        token = current_endpoint.set(endpoint); start = time.perf_counter()
+        try:
+            r = await client.request(method, endpoint, params=params, headers=headers)
+            statuses[endpoint][str(r.status_code)] += 1
+            if r.status_code >= 400: errors[endpoint] += 1
+            return r
+        except Exception as e:
+            statuses[endpoint][type(e).__name__] += 1; errors[endpoint] += 1
+        finally:
+            latencies[endpoint].append(time.perf_counter() - start); current_endpoint.reset(token)
+
+    ws_stats = {"listeners": 0, "frames": 0, "events": 0, "expected_events": 0, "disconnects": 0}
+
+    async def lecture(subject_id, roster, start_at):
+        await asyncio.sleep(max(0, start_at - time.perf_counter()))
+        r = await call("GET", "/generate-qr-string", headers=TEACHER, subject_id=subject_id, teacher_id=1, is_new="true")
+        if r is None or r.status_code != 200: return
+        session = r.json(); current = {"qr": session["current_qr_string"]}; done = asyncio.Event()
+
+        ws = ASGIWebSocket(app, f"/ws/live-attendance/{subject_id}"); await ws.connect(); ws_stats["listeners"] += 1
+        async def listen():
+            try:
+                while True:
+                    frame = await ws.receive_json(); ws_stats["frames"] += 1; ws_stats["events"] += len(frame) if isinstance(frame, list) else 1
+            except ConnectionError: ws_stats["disconnects"] += 1
+            except asyncio.CancelledError: pass
+        async def rotate():
+            # Fallback rotation path (clients without WebCrypto poll once per step)
+            while not done.is_set():
+                await asyncio.sleep(session["step"])
+                r = await call("GET", "/generate-qr-string", headers=TEACHER, subject_id=subject_id, teacher_id=1, session_id=session["session_id"])
+                if r is not None and r.status_code == 200: current["qr"] = r.json()["current_qr_string"]
+        async def scan(roll):
+            await asyncio.sleep(rng.uniform(0, args.window))
+            r = await call("POST", "/mark-attendance", roll_no=roll, qr_content=current["qr"], subject_id=subject_id, device_id=f"DEV-{roll}")
+            if r is not None and r.status_code == 200: ws_stats["expected_events"] += 1
+        listener = asyncio.create_task(listen()); rotator = asyncio.create_task(rotate())
+        await asyncio.gather(*(scan(roll) for roll in roster))
+        done.set(); rotator.cancel()
+        await asyncio.sleep(1)  # let the last batch commit and fan out before hanging up
+        listener.cancel(); await ws.close()
+
+    active = args.active_subjects or len(classes)
+    lectures = []
+    for i in range(active):
+        class_subjects, roster = classes[i % len(classes)]
+        lectures.append((class_subjects[(i // len(classes)) % len(class_subjects)], roster, rng.uniform(0, 0.5)))
+
+    async with app.router.lifespan_context(app):
+        t0 = time.perf_counter()
+        await asyncio.gather(*(lecture(sid, roster, t0 + offset) for sid, roster, offset in lectures))
+        wall = time.perf_counter() - t0
+    await client.aclose()
+
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        v = sorted(values); n = len(v)
+        endpoints[endpoint] = {"requests": n, "errors": errors[endpoint], "error_rate": round(errors[endpoint] / n, 4), "statuses": dict(statuses[endpoint]),
+                               "throughput_rps": round(n / wall, 2), "mean_ms": round(sum(v) / n * 1000, 3),
+                               **{f"p{q}_ms": round(percentile(v, q) * 1000, 3) for q in (50, 95, 99)}, "max_ms": round(v[-1] * 1000, 3),
+                               "db_statements": statements.get(endpoint, 0), "db_statements_per_request": round(statements.get(endpoint, 0) / n, 3)}
+    report = {"revision": git_revision(), "database": database.engine.dialect.name,
+              "params": {k: v for k, v in vars(args).items() if k not in ("database_url", "out")},
+              "seeded": {"students": len(students), "subjects": len(subjects), "active_subjects": active},
+              "wall_seconds": round(wall, 3), "endpoints": endpoints,
+              "background_db_statements": statements.get("(background)", 0), "websocket": ws_stats}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w") as f: f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    asyncio.run(main())
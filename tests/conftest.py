@@ -0,0 +1,9 @@
+import os, sys, tempfile
+
+# The suite imports the app the way uvicorn does (backend.main, from the repo root) against a scratch database.
+# DATABASE_URL is always overridden so a developer's real database is never touched; point
+# KNMIET_TEST_DATABASE_URL at a throwaway database to run against something other than SQLite.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT); os.chdir(ROOT)  # StaticFiles mounts ./frontend
+os.environ["DATABASE_URL"] = os.getenv("KNMIET_TEST_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp(prefix='knmiet-tests-')}/test.db"
+os.environ.setdefault("QR_MASTER_KEY", "test-only-qr-master-key-0123456789")
@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from backend import main, models, database
+
+HOD = {"x-admin-key": "CSE@2026!HOD"}
+LONG_AGO = datetime.utcnow() - timedelta(days=1)
+
+@pytest.fixture(scope="module")
+def client():
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Subject), [{"id": 1, "name": "DS", "code": "CS1", "branch": "CSE", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 4},
+                                              {"id": 2, "name": "Maths", "code": "M1", "branch": "ALL", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 4}])
+        conn.execute(insert(models.Student), [{"erp_id": f"E{r}", "roll_no": r, "name": r, "branch": "CSE", "year": 2, "section": "A", "registered_device": "D", "status": s, "total_lectures": 1, "updated_at": LONG_AGO}
+                                              for r, s in (("2300000000001", "Approved"), ("2300000000002", "Pending"))])
+        conn.execute(insert(models.Attendance), [{"student_roll": "2300000000001", "subject_id": 1, "timestamp": LONG_AGO}])
+    with TestClient(main.app) as c: yield c
+
+def test_full_pull_has_every_cell(client):
+    m = client.get("/branch-analytics", headers=HOD).json()
+    assert m["incremental"] is False and m["students"]["roll_no"] == ["2300000000001", "2300000000002"]
+    assert len(m["cells"]["student"]) == 4
+
+def test_delta_includes_students_changed_after_the_dashboard_loaded(client):
+    since = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+    assert client.get("/branch-analytics", params={"since": since}, headers=HOD).json()["students"]["roll_no"] == []
+    client.post("/update-student-status", params={"roll_no": "2300000000002", "status": "Approved"}, headers=HOD)
+    client.post("/register-student", params={"erp_id": "E3", "roll_no": "2300000000003", "name": "New", "branch": "CSE", "year": 2, "section": "A", "device_id": "D3"})
+    m = client.get("/branch-analytics", params={"since": since}, headers=HOD).json()
+    students = dict(zip(m["students"]["roll_no"], m["students"]["status"]))
+    assert students == {"2300000000002": "Approved", "2300000000003": "Pending"}
+    # Students without a single scan or mark still arrive with their full row of cells
+    assert sorted((m["students"]["roll_no"][i], m["subjects"]["id"][j]) for i, j in zip(m["cells"]["student"], m["cells"]["subject"])) == \
+        [("2300000000002", 1), ("2300000000002", 2), ("2300000000003", 1), ("2300000000003", 2)]
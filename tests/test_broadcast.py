@@ -0,0 +1,105 @@
+import asyncio, os, time
+import pytest
+
+from backend import broadcast
+
+class FakeSocket:
+    def __init__(self, delay: float = 0): self.frames = []; self.delay = delay; self.closed = False
+    async def accept(self): pass
+    async def send_json(self, data):
+        if self.delay: await asyncio.sleep(self.delay)
+        self.frames.append(data)
+    async def close(self): self.closed = True
+
+def run(coro): return asyncio.run(coro)
+
+def test_burst_is_coalesced_into_one_frame():
+    async def scenario():
+        manager = broadcast.ConnectionManager(coalesce_window=0.05); ws = FakeSocket()
+        await manager.start(); await manager.connect(ws, 1)
+        await manager.broadcast_many([(1, {"roll_no": f"R{i}"}) for i in range(5)] + [(2, {"roll_no": "other"})])
+        await asyncio.sleep(0.2); await manager.stop()
+        return ws, manager
+    ws, manager = run(scenario())
+    assert ws.frames == [[{"roll_no": f"R{i}"} for i in range(5)]]
+    assert manager.frames_sent[1] == 1 and manager.events_sent[1] == 5
+
+def test_client_is_evicted_when_its_queue_overflows():
+    async def scenario():
+        manager = broadcast.ConnectionManager(queue_size=2, coalesce_window=1); slow, fast = FakeSocket(), FakeSocket()
+        await manager.start(); await manager.connect(slow, 1)
+        await manager.broadcast_many([(1, {"n": i}) for i in range(4)])  # the sender hasn't drained anything yet
+        await manager.connect(fast, 1); await manager.broadcast(1, {"n": 4})
+        await asyncio.sleep(0.05); connected = [c.websocket for c in manager.active_connections.get(1, [])]
+        await manager.stop()
+        return slow, fast, connected, manager
+    slow, fast, connected, manager = run(scenario())
+    assert slow.closed and slow not in connected and fast in connected
+    assert manager.evictions == 1
+
+def test_client_is_evicted_when_a_send_times_out():
+    async def scenario():
+        manager = broadcast.ConnectionManager(coalesce_window=0, send_timeout=0.05); stuck = FakeSocket(delay=1)
+        await manager.start(); await manager.connect(stuck, 1)
+        await manager.broadcast(1, {"n": 1}); await asyncio.sleep(0.2)
+        remaining = manager.active_connections.get(1, []); await manager.stop()
+        return stuck, remaining, manager
+    stuck, remaining, manager = run(scenario())
+    assert stuck.closed and remaining == [] and stuck.frames == []
+    assert manager.evictions == 1
+
+# --- POSTGRES BUS: needs a scratch server, e.g. KNMIET_TEST_PG_DSN=postgresql://postgres@localhost/postgres ---
+PG_DSN = os.getenv("KNMIET_TEST_PG_DSN")
+needs_pg = pytest.mark.skipif(not PG_DSN, reason="set KNMIET_TEST_PG_DSN to run the Postgres bus tests")
+
+async def wait_for(predicate, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: raise AssertionError("timed out")
+        await asyncio.sleep(0.02)
+
+def terminate(pid: int):
+    import psycopg2
+    conn = psycopg2.connect(PG_DSN); conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        for _ in range(100):  # termination is asynchronous
+            cur.execute("SELECT 1 FROM pg_stat_activity WHERE pid = %s", (pid,))
+            if cur.fetchone() is None: break
+            time.sleep(0.02)
+    conn.close()
+
+@needs_pg
+def test_postgres_bus_round_trip():
+    async def scenario():
+        channel = f"knmiet_test_{os.getpid()}"; got_a, got_b = [], []
+        a, b = broadcast.PostgresBus(PG_DSN, channel), broadcast.PostgresBus(PG_DSN, channel)
+        await a.start(got_a.extend); await b.start(got_b.extend)
+        try:
+            await a.publish([(7, {"roll_no": "R1"}), (8, {"roll_no": "R2"})])
+            await wait_for(lambda: len(got_b) == 2); await asyncio.sleep(0.1)
+        finally: await a.stop(); await b.stop()
+        return got_a, got_b
+    got_a, got_b = run(scenario())
+    assert got_b == [[7, {"roll_no": "R1"}], [8, {"roll_no": "R2"}]]
+    assert got_a == []  # a worker never re-delivers its own events
+
+@needs_pg
+def test_postgres_bus_reconnects_after_losing_its_connections():
+    async def scenario():
+        channel = f"knmiet_test_rc_{os.getpid()}"; got = []
+        a = broadcast.PostgresBus(PG_DSN, channel, reconnect_delay=0.05); b = broadcast.PostgresBus(PG_DSN, channel, reconnect_delay=0.05)
+        await a.start(lambda items: None); await b.start(got.extend)
+        try:
+            # Listener dropped: the reader callback notices, the bus reconnects and LISTENs again
+            old = b.listen_conn; terminate(old.get_backend_pid())
+            await wait_for(lambda: b.listen_conn is not None and b.listen_conn is not old)
+            await a.publish([(1, {"n": 1})]); await wait_for(lambda: len(got) == 1)
+            # Publisher dropped: that publish is lost (and logged), the next one goes through
+            old = a.notify_conn; terminate(old.get_backend_pid())
+            await a.publish([(1, {"n": "lost"})])
+            await wait_for(lambda: a.notify_conn is not None and a.notify_conn is not old)
+            await a.publish([(1, {"n": 2})]); await wait_for(lambda: len(got) == 2)
+        finally: await a.stop(); await b.stop()
+        return got
+    assert run(scenario()) == [[1, {"n": 1}], [1, {"n": 2}]]
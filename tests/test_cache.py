@@ -0,0 +1,64 @@
+import asyncio, os, threading, uuid
+import pytest
+
+from backend import broadcast
+from backend.cache import ResponseCache
+
+PG_DSN = os.getenv("KNMIET_TEST_PG_DSN")
+
+def fill(cache, key, during=lambda: None):
+    # What cached() does, with a hook for writes that commit while the payload is being built
+    generation = cache.generation(key); during(); cache.put(key, b"{}", generation)
+    return cache.get(key) is not None
+
+def test_a_fill_survives_invalidations_of_other_keys():
+    cache = ResponseCache()
+    assert fill(cache, ("profile", "A"), lambda: [cache.invalidate("profile", "B"), cache.invalidate("erp", "A"), cache.invalidate("history", "A")])
+
+def test_a_fill_is_dropped_when_its_own_key_is_invalidated_meanwhile():
+    cache = ResponseCache()
+    assert not fill(cache, ("profile", "A"), lambda: cache.invalidate("profile", "A"))
+    assert not fill(cache, ("profile", "A"), lambda: cache.invalidate("profile"))
+    assert not fill(cache, ("profile", "A"), lambda: cache.invalidate())
+    assert fill(cache, ("profile", "A"))
+
+def test_pruned_stamps_stay_conservative():
+    cache = ResponseCache(max_entries=4)
+    assert not fill(cache, ("profile", "A"), lambda: [cache.invalidate("erp", str(i)) for i in range(10)])  # pruning can only drop fills
+    assert len(cache.stamps) <= 4 and fill(cache, ("profile", "A"))
+
+class FakeBus:
+    def __init__(self): self.published = []
+    async def start(self, handler): self.handler = handler
+    async def publish(self, items): self.published.append(items)
+    async def stop(self): pass
+
+def test_invalidations_are_batched_onto_the_bus_and_replayed_remotely():
+    async def scenario():
+        here, there, bus = ResponseCache(), ResponseCache(), FakeBus()
+        await here.start(bus); there.put(("erp", "A"), b"{}", 0); there.put(("erp", "B"), b"{}", 0)
+        workers = [threading.Thread(target=here.invalidate, args=("erp", roll)) for roll in "AC"]
+        for w in workers: w.start()
+        for w in workers: w.join()
+        await asyncio.sleep(0.05); await here.stop()
+        for items in bus.published: there._remote(items)
+        return bus, there
+    bus, there = asyncio.run(scenario())
+    assert sorted(p for items in bus.published for p in items) == [["erp", "A"], ["erp", "C"]] and len(bus.published) == 1
+    assert there.get(("erp", "A")) is None and there.get(("erp", "B")) is not None
+
+@pytest.mark.skipif(not PG_DSN, reason="set KNMIET_TEST_PG_DSN to a scratch Postgres to run the LISTEN/NOTIFY tests")
+def test_postgres_bus_carries_invalidations_between_workers():
+    async def scenario():
+        channel = f"test_cache_{uuid.uuid4().hex[:8]}"
+        here, there = ResponseCache(), ResponseCache()
+        await here.start(broadcast.PostgresBus(PG_DSN, channel)); await there.start(broadcast.PostgresBus(PG_DSN, channel))
+        there.put(("profile", "A"), b"{}", 0); there.put(("profile", "B"), b"{}", 0)
+        here.invalidate("profile", "A")
+        for _ in range(100):
+            if there.get(("profile", "A")) is None: break
+            await asyncio.sleep(0.02)
+        await here.stop(); await there.stop()
+        return there
+    there = asyncio.run(scenario())
+    assert there.get(("profile", "A")) is None and there.get(("profile", "B")) is not None
@@ -0,0 +1,73 @@
+import asyncio, time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, insert, select
+
+from backend import main, models, database, ingest
+
+ROLLS = ["2300000000001", "2300000000002"]
+
+@pytest.fixture()
+def db():
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Teacher), [{"id": 1, "name": "T", "email": "t@x", "pin": "2468", "role": "Faculty", "department": "CSE"}])
+        conn.execute(insert(models.Subject), [{"id": i, "name": f"S{i}", "code": f"C{i}", "branch": "CSE", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 0} for i in (1, 2, 3)])
+        conn.execute(insert(models.Student), [{"erp_id": f"E{r}", "roll_no": r, "name": r, "branch": "CSE", "year": 2, "section": "A", "registered_device": "D", "status": "Approved", "total_lectures": 1} for r in ROLLS])
+    return database.engine
+
+def lectures(engine):
+    with engine.connect() as conn: return dict(conn.execute(select(models.Student.roll_no, models.Student.total_lectures)).all())
+
+def run_batch(batcher, keys):
+    async def scenario():
+        futs = [batcher.submit(r, s, {"subject_id": s, "payload": {"roll_no": r}}) for r, s in keys]
+        results = await asyncio.gather(*futs, return_exceptions=True); await batcher.stop()
+        return results
+    return asyncio.run(scenario())
+
+def test_one_commit_per_batch_with_per_student_increments(db):
+    commits, committed = [], []
+    listener = lambda conn: commits.append(1); event.listen(db, "commit", listener)
+    async def on_commit(events): committed.append(events)
+    try: results = run_batch(ingest.ScanBatcher(on_commit, flush_interval=0.05), [(ROLLS[0], 1), (ROLLS[0], 2), (ROLLS[0], 3), (ROLLS[1], 1), (ROLLS[1], 3)])
+    finally: event.remove(db, "commit", listener)
+    assert results == [True] * 5 and len(commits) == 1 and len(committed) == 1 and len(committed[0]) == 5
+    assert lectures(db) == {ROLLS[0]: 4, ROLLS[1]: 3}
+    with db.connect() as conn: assert conn.scalar(select(func.count()).select_from(models.Attendance)) == 5
+
+def test_in_flight_duplicates_are_refused(db):
+    async def scenario():
+        async def on_commit(events): pass
+        batcher = ingest.ScanBatcher(on_commit, flush_interval=0.05)
+        first = batcher.submit(ROLLS[0], 1, {}); again = batcher.submit(ROLLS[0], 1, {}); other = batcher.submit(ROLLS[0], 2, {})
+        pending = batcher.is_pending(ROLLS[0], 1)
+        await asyncio.gather(first, other); settled = batcher.is_pending(ROLLS[0], 1); await batcher.stop()
+        return again, pending, settled
+    again, pending, settled = asyncio.run(scenario())
+    assert again is None and pending and not settled
+    assert lectures(db) == {ROLLS[0]: 3, ROLLS[1]: 1}
+
+def test_failed_batch_is_retried_row_by_row(db, monkeypatch):
+    monkeypatch.setattr(ingest, "SCAN_RETRY_DELAY", 0)
+    calls, committed = [], []
+    def flaky(keys):
+        calls.append(list(keys))
+        if len(calls) == 1: raise RuntimeError("deadlock detected")  # transient: the whole batch fails once
+        if keys == [(ROLLS[1], 1)]: raise ValueError("bad row")      # this one never lands
+        ingest.write_scan_batch(keys)
+    async def on_commit(events): committed.extend(e["payload"]["roll_no"] for e in events)
+    results = run_batch(ingest.ScanBatcher(on_commit, flush_interval=0.05, writer=flaky), [(ROLLS[0], 1), (ROLLS[1], 1), (ROLLS[0], 2)])
+    assert calls == [[(ROLLS[0], 1), (ROLLS[1], 1), (ROLLS[0], 2)], [(ROLLS[0], 1)], [(ROLLS[1], 1)], [(ROLLS[0], 2)]]
+    assert results[0] is True and isinstance(results[1], ValueError) and results[2] is True
+    assert committed == [ROLLS[0], ROLLS[0]] and lectures(db) == {ROLLS[0]: 3, ROLLS[1]: 1}
+
+@pytest.mark.skipif(not ingest.SCAN_BATCHING, reason="SCAN_BATCHING=0 writes scans inline")
+def test_scan_slower_than_the_ack_timeout_is_queued(db, monkeypatch):
+    monkeypatch.setattr(ingest, "SCAN_ACK_TIMEOUT", 0.05)
+    monkeypatch.setattr(main.scan_batcher, "writer", lambda keys: [time.sleep(0.3), ingest.write_scan_batch(keys)])
+    with TestClient(main.app) as c:
+        s = c.get("/generate-qr-string", params={"subject_id": 1, "teacher_id": 1, "is_new": True}, headers={"x-teacher-pin": "2468"}).json()
+        r = c.post("/mark-attendance", params={"roll_no": ROLLS[0], "qr_content": s["current_qr_string"], "subject_id": 1, "device_id": "D"})
+        assert (r.status_code, r.json()) == (202, {"status": "Queued"})
+    assert lectures(db)[ROLLS[0]] == 2  # still written: shutdown drains the batcher
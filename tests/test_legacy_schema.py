@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select, text
+
+from backend import main, models, database
+
+HOD = {"x-admin-key": "CSE@2026!HOD"}
+
+@pytest.fixture(scope="module")
+def client():
+    # A database from before the series: updated_at arrives through add_missing_columns, i.e. without any DB default
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        for table in ("students", "exam_marks"): conn.execute(text(f"ALTER TABLE {table} DROP COLUMN updated_at"))
+    database.add_missing_columns(models.Base.metadata, database.engine)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Subject), [{"id": 1, "name": "DS", "code": "CS1", "branch": "CSE", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 0}])
+    with TestClient(main.app) as c: yield c
+
+def test_writes_on_a_migrated_schema_reach_the_delta(client):
+    since = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+    client.post("/register-student", params={"erp_id": "E1", "roll_no": "2300000000001", "name": "New", "branch": "CSE", "year": 2, "section": "A", "device_id": "D1"})
+    with database.engine.connect() as conn: assert conn.scalar(select(models.Student.updated_at)) is not None  # before any UPDATE fires onupdate
+    client.post("/update-student-status", params={"roll_no": "2300000000001", "status": "Approved"}, headers=HOD)
+    assert client.post("/update-marks", params={"roll_no": "2300000000001", "subject_id": 1, "s1": 12, "s2": 0, "put": 0}).status_code == 200
+    with database.engine.connect() as conn:
+        assert conn.scalar(select(models.ExamMarks.updated_at)) is not None  # first insert, not just the ON CONFLICT branch
+    m = client.get("/branch-analytics", params={"since": since}, headers=HOD).json()
+    assert m["students"]["roll_no"] == ["2300000000001"] and m["cells"]["s1"] == [12]
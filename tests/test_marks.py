@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from backend import main, models, database, marks
+
+ROLLS = ["2300000000001", "2300000000002"]
+
+@pytest.fixture(scope="module")
+def client():
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Subject), [{"id": 1, "name": "DS", "code": "CS1", "branch": "CSE", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 0}])
+        conn.execute(insert(models.Student), [{"erp_id": f"E{r}", "roll_no": r, "name": r, "branch": "CSE", "year": 2, "section": "A", "registered_device": "D", "status": "Approved", "total_lectures": 0} for r in ROLLS])
+    with TestClient(main.app) as c: yield c
+
+def stored(roll):
+    M = models.ExamMarks
+    with database.engine.connect() as conn: return conn.execute(select(M.sessional_1, M.sessional_2, M.put_marks).where(M.student_roll == roll, M.subject_id == 1)).one()
+
+def test_upsert_rules(client):
+    E = marks.MarkEntry
+    with Session(database.engine) as db:
+        assert marks.upsert_marks(db, 1, [E(roll_no=ROLLS[0], s1=10, s2=12, put=30)]) == 1; db.commit()
+        # > 0 overwrites, 0 keeps what is stored
+        marks.upsert_marks(db, 1, [E(roll_no=ROLLS[0], s1=0, s2=14)]); db.commit()
+        assert tuple(stored(ROLLS[0])) == (10, 14, 30)
+        # Several entries for one roll fold into one row; the last non-zero value wins
+        assert marks.upsert_marks(db, 1, [E(roll_no=ROLLS[1], s1=5, put=20), E(roll_no=ROLLS[1], s1=7), E(roll_no=ROLLS[0], put=35)]) == 2; db.commit()
+        assert tuple(stored(ROLLS[1])) == (7, 0, 20) and tuple(stored(ROLLS[0])) == (10, 14, 35)
+
+def test_bad_cells_are_rejected_before_anything_is_stored(client):
+    body = '{"subject_id": 1, "marks": [{"roll_no": "%s", "s1": 9}, {"roll_no": "%s", "s1": %s}]}'
+    for bad in ("Infinity", "NaN", "-1", str(marks.MARKS_MAX + 1)):
+        assert client.post("/update-marks-batch", content=body % (ROLLS[0], ROLLS[1], bad), headers={"content-type": "application/json"}).status_code == 422
+        assert client.post("/update-marks", params={"roll_no": ROLLS[1], "subject_id": 1, "s1": bad, "s2": 0, "put": 0}).status_code == 422
+    assert tuple(stored(ROLLS[0])) == (10, 14, 35)
+    assert client.get("/subject-roster", params={"subject_id": 1}).status_code == 200
@@ -0,0 +1,60 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+
+from backend import main, models, database
+from backend.cache import response_cache
+
+# Every read endpoint must issue the same number of SQL statements whatever the roster size: a count that
+# grows with the class is an N+1 regression. Two classes of very different size are seeded side by side.
+ADMIN = {"x-admin-key": "KNM@2026!Admin"}
+
+def seed_class(section: str, students: int, subjects: int):
+    rolls = [f"2CSE{section}{n:04d}" for n in range(students)]
+    with database.engine.begin() as conn:
+        ids = [conn.execute(insert(models.Subject).values(name=f"Sub {section}{k}", code=f"CS{section}{k}", branch="CSE", year=2, section=section, teacher_id=1, total_lectures_held=3)).inserted_primary_key[0] for k in range(subjects)]
+        conn.execute(insert(models.Student), [{"erp_id": f"E{r}", "roll_no": r, "name": f"Student {r}", "branch": "CSE", "year": 2, "section": section, "registered_device": f"D{r}", "status": "Approved", "total_lectures": 2 * subjects} for r in rolls])
+        conn.execute(insert(models.Attendance), [{"student_roll": r, "subject_id": i} for r in rolls for i in ids for _ in range(2)])
+        conn.execute(insert(models.ExamMarks), [{"student_roll": r, "subject_id": i, "sessional_1": 10, "sessional_2": 12, "put_marks": 30} for r in rolls for i in ids])
+        conn.execute(insert(models.LeaveRequest), [{"student_roll": r, "date_req": "01-09-26", "reason": "Fever", "status": "Pending"} for r in rolls])
+    return rolls, ids
+
+@pytest.fixture(scope="module")
+def client():
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with TestClient(main.app) as c: yield c
+
+@pytest.fixture(scope="module")
+def classes(client):
+    return {"small": seed_class("A", students=3, subjects=2), "large": seed_class("B", students=40, subjects=6)}
+
+def count_statements(client, path, **kwargs):
+    statements = []
+    def record(conn, cursor, statement, *args): statements.append(statement)
+    engines = (database.engine, database.async_engine.sync_engine)
+    for eng in engines: event.listen(eng, "before_cursor_execute", record)
+    try:
+        response_cache.invalidate()  # measure the database path, not a cache hit
+        r = client.get(path, **kwargs); assert r.status_code == 200, r.text
+    finally:
+        for eng in engines: event.remove(eng, "before_cursor_execute", record)
+    return len(statements)
+
+@pytest.mark.parametrize("path, params", [
+    ("/subject-roster", lambda rolls, ids: {"subject_id": ids[0]}),
+    ("/student-erp-data", lambda rolls, ids: {"roll_no": rolls[0]}),
+    ("/live-attendance", lambda rolls, ids: {"subject_id": ids[0]}),
+    ("/pending-leaves", None),
+])
+def test_statement_count_does_not_grow_with_the_roster(client, classes, path, params):
+    counts = {}
+    for size, (rolls, ids) in classes.items():
+        kwargs = {"headers": ADMIN} if params is None else {"params": params(rolls, ids)}
+        counts[size] = count_statements(client, path, **kwargs)
+    assert counts["small"] == counts["large"], counts
+    assert counts["small"] <= 3, counts
+
+def test_payloads_cover_the_whole_class(client, classes):
+    rolls, ids = classes["large"]
+    assert len(client.get("/subject-roster", params={"subject_id": ids[0]}).json()["roster"]) == len(rolls)
+    assert len(client.get("/student-erp-data", params={"roll_no": rolls[0]}).json()["subjects"]) == len(ids)
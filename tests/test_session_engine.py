@@ -0,0 +1,72 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+from backend import main, models, database, session_engine as se
+
+PIN = {"x-teacher-pin": "2468"}
+ROLL = "2300000000001"
+
+def code_at(subject_id, session_id, t): return f"{session_id}.{se.session_totp(subject_id, session_id).at(int(t))}"
+
+# --- verify_qr: pure CPU checks ---
+def test_codes_are_accepted_within_the_skew_window_only():
+    sid = se.new_session_id(); now = se.session_started(sid) + 600
+    assert se.verify_qr(1, code_at(1, sid, now), now=now)
+    assert se.verify_qr(1, code_at(1, sid, now - se.QR_SKEW * se.QR_STEP), now=now)
+    assert se.verify_qr(1, code_at(1, sid, now + se.QR_SKEW * se.QR_STEP), now=now)
+    assert not se.verify_qr(1, code_at(1, sid, now - (se.QR_SKEW + 1) * se.QR_STEP), now=now)  # screenshot passed around
+
+def test_codes_expire_with_the_session_cap():
+    sid = se.new_session_id(); started = se.session_started(sid)
+    assert se.verify_qr(1, code_at(1, sid, started + se.QR_SESSION_MAX), now=started + se.QR_SESSION_MAX)
+    late = started + se.QR_SESSION_MAX + se.QR_STEP
+    assert not se.verify_qr(1, code_at(1, sid, late), now=late)
+    early = started - 2 * se.QR_STEP
+    assert not se.verify_qr(1, code_at(1, sid, early), now=early)
+
+def test_forged_codes_are_rejected():
+    sid = se.new_session_id(); now = se.session_started(sid) + 10
+    assert not se.verify_qr(2, code_at(1, sid, now), now=now)  # code of another subject
+    window = {code_at(1, sid, now + k * se.QR_STEP) for k in range(-se.QR_SKEW, se.QR_SKEW + 1)}
+    assert not se.verify_qr(1, next(f"{sid}.{n:06d}" for n in range(10 ** 6) if f"{sid}.{n:06d}" not in window), now=now)  # guessed code
+    assert not se.verify_qr(1, f"zzzz{sid[-4:]}.{code_at(1, sid, now).partition('.')[2]}", now=now)  # unparsable start time
+    for junk in ("", ".", sid, f"{sid}."): assert not se.verify_qr(1, junk, now=now)
+
+# --- lifecycle through the API: open sessions live in qr_sessions ---
+@pytest.fixture(scope="module")
+def client():
+    models.Base.metadata.drop_all(bind=database.engine); models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.Teacher), [{"id": 1, "name": "T", "email": "t@x", "pin": "2468", "role": "Faculty", "department": "CSE"}])
+        conn.execute(insert(models.Subject), [{"id": 1, "name": "DS", "code": "CS1", "branch": "CSE", "year": 2, "section": "A", "teacher_id": 1, "total_lectures_held": 0}])
+        conn.execute(insert(models.Student), [{"erp_id": "E1", "roll_no": ROLL, "name": "S", "branch": "CSE", "year": 2, "section": "A", "registered_device": "D1", "status": "Approved", "total_lectures": 0}])
+    with TestClient(main.app) as c: yield c
+
+def scan(client, qr): return client.post("/mark-attendance", params={"roll_no": ROLL, "qr_content": qr, "subject_id": 1, "device_id": "D1"})
+
+def test_teacher_list_does_not_leak_pins(client):
+    assert client.get("/get-teachers").json() == [{"id": 1, "name": "T", "role": "Faculty"}]
+
+def test_sessions_need_the_subject_teachers_pin(client):
+    assert client.get("/generate-qr-string", params={"subject_id": 1, "teacher_id": 1, "is_new": True}).status_code == 422
+    assert client.get("/generate-qr-string", params={"subject_id": 1, "teacher_id": 1, "is_new": True}, headers={"x-teacher-pin": "0000"}).status_code == 401
+
+def test_stopped_session_rejects_scans_polls_and_renewals(client):
+    s = client.get("/generate-qr-string", params={"subject_id": 1, "teacher_id": 1, "is_new": True}, headers=PIN).json()
+    ids = {"subject_id": 1, "teacher_id": 1, "session_id": s["session_id"]}
+    assert client.post("/renew-session", params=ids, headers=PIN).status_code == 200
+    assert client.post("/stop-session", params=ids, headers=PIN).json()["sessions"] == 1
+    assert scan(client, se.current_qr(1, s["session_id"])).status_code == 400
+    assert client.get("/generate-qr-string", params=ids, headers=PIN).status_code == 410
+    assert client.post("/renew-session", params=ids, headers=PIN).status_code == 410
+
+def test_forged_session_id_is_rejected_even_with_a_valid_code(client):
+    # Only the master key holder can compute codes, but an id that was never started stays closed regardless
+    sid = se.new_session_id(); assert abs(se.session_started(sid) - time.time()) < 5
+    assert scan(client, se.current_qr(1, sid)).status_code == 400
+
+def test_open_session_accepts_a_scan(client):
+    s = client.get("/generate-qr-string", params={"subject_id": 1, "teacher_id": 1, "is_new": True}, headers=PIN).json()
+    assert scan(client, s["current_qr_string"]).json()["status"] in ("Success", "Queued")